@@ -0,0 +1,114 @@
+"""
+Palm keypoint budgets: scores, latency and template size per budget.
+
+For every budget (8x8 grid, strongest N keypoints per cell) the LUTBIO
+palm_touch images are enrolled and matched (genuine pairs + random impostor
+pairs) with PalmService.verify, and a threshold is suggested the same way
+as benchmark_palm_orb.py. Scores are RANSAC inliers (geometric stage), with
+FAR/FRR at palm_service.MIN_INLIERS; with --legacy the keypoint coordinates
+are dropped from the templates to score ratio test survivors instead
+(against RATIO_THRESHOLD, calibrated on unbounded templates only).
+The geometric stage stays opt-in (PALM_GEOMETRIC=1) until this run backs
+MIN_INLIERS and GEOMETRIC_BUDGET.
+
+Usage (from the project root):
+    python backend/benchmark_palm_budget.py [--dataset PATH] [--matcher lsh] [--impostors 300] [--legacy]
+"""
+
+import os
+import sys
+import glob
+import time
+import random
+import json
+import argparse
+from itertools import combinations
+
+import numpy as np
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from backend.services.palm_service import PalmService, budget_size, MIN_INLIERS, RATIO_THRESHOLD
+
+DATASET = "/home/red/Documents/S5/Biom Sec/Project/LUTBIO sample data"
+BUDGETS = [None] + [{"grid": [8, 8], "per_cell": n} for n in (4, 8, 16, 32)]
+
+
+def collect_images(dataset_path):
+    users = {}
+    for uid in sorted(os.listdir(dataset_path)):
+        touch = os.path.join(dataset_path, uid, "palm_touch")
+        if os.path.isdir(touch):
+            paths = sorted(glob.glob(os.path.join(touch, "*")))
+            if paths:
+                users[uid] = [open(p, "rb").read() for p in paths]
+    return users
+
+
+def strip_points(template):
+    data = json.loads(template)
+    data.pop("kp", None)
+    return json.dumps(data)
+
+
+def benchmark_budget(service, users, n_impostors, legacy=False):
+    # 1. Enroll every image
+    templates = {uid: [service.create_template(b) for b in images] for uid, images in users.items()}
+    if legacy:
+        templates = {uid: [t and strip_points(t) for t in tpls] for uid, tpls in templates.items()}
+    sizes = [len(t) for tpls in templates.values() for t in tpls if t]
+
+    # 2. Genuine: every pair of a user, Impostor: random pairs across users
+    genuine, impostor, times = [], [], []
+    for uid, images in users.items():
+        for i, j in combinations(range(len(images)), 2):
+            if templates[uid][j]:
+                start = time.perf_counter()
+                genuine.append(service.verify(images[i], templates[uid][j])[1])
+                times.append((time.perf_counter() - start) * 1000)
+
+    uids = list(users)
+    for _ in range(n_impostors):
+        u1, u2 = random.sample(uids, 2)
+        tpl = random.choice(templates[u2])
+        if tpl:
+            impostor.append(service.verify(random.choice(users[u1]), tpl)[1])
+
+    return np.array(genuine), np.array(impostor), np.median(times), np.mean(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", default=DATASET)
+    parser.add_argument("--matcher", default="bf", choices=["bf", "lsh"])
+    parser.add_argument("--impostors", type=int, default=300)
+    parser.add_argument("--legacy", action="store_true", help="Score without the geometric stage")
+    args = parser.parse_args()
+
+    users = collect_images(args.dataset)
+    print(f"[-] Found {len(users)} users with {sum(len(v) for v in users.values())} palm images.")
+
+    kind = "ratio test survivors" if args.legacy else "RANSAC inliers"
+    print(f"\n--- RESULTS ({kind}, verify latency incl. AKAZE) ---")
+    for budget in BUDGETS:
+        service = PalmService(matcher=args.matcher, budget=budget, geometric=not args.legacy)
+        g, i, ms, size = benchmark_budget(service, users, args.impostors, args.legacy)
+        name = "unbounded" if budget is None else str(budget_size(budget))
+        if len(g) == 0 or len(i) == 0:
+            print(f"[{name}] Not enough data.")
+            continue
+
+        # Same rule as benchmark_palm_orb.py
+        suggested = int(i.max() * 1.5) + 5
+        if suggested > g.mean():
+            suggested = int((g.mean() + i.max()) / 2)
+        threshold = RATIO_THRESHOLD if args.legacy else MIN_INLIERS
+        print(f"[{name:>9}] Genuine mean {g.mean():.1f} (min {g.min()}), Impostor max {i.max()}, "
+              f"{ms:.0f} ms, template {size / 1024:.0f} KB | "
+              f"threshold {threshold:.0f} (FAR {np.mean(i >= threshold):.2%}, FRR {np.mean(g < threshold):.2%}), "
+              f"suggested {suggested}")
+
+
+if __name__ == "__main__":
+    main()
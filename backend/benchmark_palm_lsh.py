@@ -0,0 +1,92 @@
+"""
+Palm 1:1: multi-probe LSH matcher vs brute-force knnMatch (scores + latency).
+
+Runs both PalmService matchers on the same genuine / impostor pairs of the
+LUTBIO palm images (palm_touch). Feature extraction is done once per image,
+so the timings are the matching step only.
+
+Usage (from the project root):
+    python backend/benchmark_palm_lsh.py [--dataset PATH] [--impostors 500]
+"""
+
+import os
+import sys
+import glob
+import time
+import random
+import argparse
+from itertools import combinations
+
+import numpy as np
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from backend.services.palm_service import PalmService
+
+DATASET = "/home/red/Documents/S5/Biom Sec/Project/LUTBIO sample data"
+
+
+def load_features(service, dataset_path):
+    """
+    uid -> [PalmTemplate] for every palm_touch image.
+    """
+    users = {}
+    for uid in sorted(os.listdir(dataset_path)):
+        touch = os.path.join(dataset_path, uid, "palm_touch")
+        if not os.path.isdir(touch):
+            continue
+        for p in sorted(glob.glob(os.path.join(touch, "*"))):
+            with open(p, "rb") as f:
+                tpl = service.create_template(f.read())
+            if tpl:
+                users.setdefault(uid, []).append(service.load_template(tpl))
+    return users
+
+
+def benchmark_palm_lsh(dataset_path, n_impostors):
+    bf = PalmService(matcher="bf")
+    lsh = PalmService(matcher="lsh")
+
+    print("[-] Extracting features...")
+    users = load_features(bf, dataset_path)
+    print(f"[-] {len(users)} users, {sum(len(v) for v in users.values())} templates.")
+
+    # 1. Pairs: every genuine pair, random impostor pairs
+    genuine = [(a, b) for feats in users.values() for a, b in combinations(feats, 2)]
+    uids = list(users)
+    impostor = []
+    for _ in range(n_impostors):
+        u1, u2 = random.sample(uids, 2)
+        impostor.append((random.choice(users[u1]), random.choice(users[u2])))
+
+    # 2. Score with both matchers (live = first, stored = second)
+    results = {}
+    for name, service in (("bf", bf), ("lsh", lsh)):
+        scores, times = {"genuine": [], "impostor": []}, []
+        for kind, pairs in (("genuine", genuine), ("impostor", impostor)):
+            for live, stored in pairs:
+                start = time.perf_counter()
+                scores[kind].append(service.match(live.descriptors, stored.descriptors, stored.keys))
+                times.append((time.perf_counter() - start) * 1000)
+        results[name] = (scores, times)
+
+    # 3. Report
+    print("\n--- RESULTS (ratio test survivors) ---")
+    for name, (scores, times) in results.items():
+        g, i = np.array(scores["genuine"]), np.array(scores["impostor"])
+        print(f"[{name}] Genuine mean {g.mean():.1f} (min {g.min()}), Impostor mean {i.mean():.1f} (max {i.max()}), "
+              f"match {np.median(times):.1f} ms (median)")
+        for threshold in (50, 100, 150):
+            print(f"      T={threshold}: FAR {np.mean(i >= threshold):.2%}, FRR {np.mean(g < threshold):.2%}")
+
+    g_bf, g_lsh = np.array(results["bf"][0]["genuine"]), np.array(results["lsh"][0]["genuine"])
+    print(f"LSH / BF genuine score ratio: {np.median(g_lsh / np.maximum(g_bf, 1)):.2f} (median)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", default=DATASET)
+    parser.add_argument("--impostors", type=int, default=500)
+    args = parser.parse_args()
+    benchmark_palm_lsh(args.dataset, args.impostors)
@@ -9,9 +9,17 @@ Eye Image → Iris Normalization → Gabor Encoding
 Secure, performant, industry-standard.
 """
 
+from functools import lru_cache
+
 import cv2
 import numpy as np
 
+try:
+    from .services import hamming
+except ImportError:
+    # Run as a script (python iris_cancelable_recognition.py from backend/)
+    from services import hamming
+
 
 # ======================================================
 # 1. IRIS NORMALIZATION (RUBBER SHEET MODEL - SIMPLIFIED)
@@ -35,16 +43,18 @@ def normalize_iris(eye_img, radius=80):
 # 2. DAUGMAN GABOR ENCODING
 # ======================================================
 
-def gabor_encode(normalized_iris):
-    gabor = cv2.getGaborKernel(
-        ksize=(21, 21),
-        sigma=4.0,
-        theta=0,
-        lambd=10.0,
-        gamma=0.5
-    )
+# Built once, not per image
+GABOR_KERNEL = cv2.getGaborKernel(
+    ksize=(21, 21),
+    sigma=4.0,
+    theta=0,
+    lambd=10.0,
+    gamma=0.5
+)
 
-    filtered = cv2.filter2D(normalized_iris, cv2.CV_32F, gabor)
+
+def gabor_encode(normalized_iris):
+    filtered = cv2.filter2D(normalized_iris, cv2.CV_32F, GABOR_KERNEL)
 
     # Binary IrisCode
     iriscode = (filtered > 0).astype(np.uint8).flatten()
@@ -55,10 +65,16 @@ def gabor_encode(normalized_iris):
 # 3. CANCELABLE BIOMETRICS
 # ======================================================
 
+@lru_cache(maxsize=64)
+def cancelable_mask(seed, n):
+    # Private RandomState: same stream as np.random.seed(seed), no global state
+    mask = np.random.RandomState(seed).randint(0, 2, size=n).astype(np.uint8)
+    mask.setflags(write=False)
+    return mask
+
+
 def cancelable_iriscode(iriscode, seed=42):
-    np.random.seed(seed)
-    mask = np.random.randint(0, 2, size=len(iriscode))
-    return np.bitwise_xor(iriscode, mask)
+    return np.bitwise_xor(iriscode, cancelable_mask(seed, iriscode.shape[-1]))
 
 
 # ======================================================
@@ -85,7 +101,38 @@ def authenticate(eye1, eye2, threshold=0.32):
 
 
 # ======================================================
-# 6. EXAMPLE
+# 6. EVALUATION (ALL-VS-ALL)
+# ======================================================
+
+def distance_matrix(eyes, seed=42, shifts=(0,)):
+    """
+    Every eye against every eye in one blocked, multi-threaded pass
+    (see hamming.distance_matrix). With shifts, each probe is also tried
+    rolled by those columns and the best distance is kept.
+    """
+    polar = [normalize_iris(eye) for eye in eyes]
+    nbits = polar[0].size
+
+    templates = hamming.pack_bits(np.stack([cancelable_iriscode(gabor_encode(p), seed) for p in polar]))
+    probes = hamming.pack_bits(np.stack([
+        [cancelable_iriscode(gabor_encode(np.roll(p, s, axis=1)), seed) for s in shifts]
+        for p in polar
+    ]))
+    return hamming.distance_matrix(probes, templates, nbits)
+
+
+def genuine_impostor(matrix, labels):
+    """
+    Split the off-diagonal distances of a self-matrix by same/different label.
+    """
+    labels = np.asarray(labels)
+    same = labels[:, None] == labels[None, :]
+    off_diag = ~np.eye(len(labels), dtype=bool)
+    return matrix[same & off_diag], matrix[~same]
+
+
+# ======================================================
+# 7. EXAMPLE
 # ======================================================
 
 if __name__ == "__main__":
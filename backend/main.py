@@ -1,10 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .database import engine, Base
+from .database import engine, Base, SessionLocal
 from .routers import auth
+from .migrations import add_missing_columns
+from .services.iris_gallery import iris_gallery
+from .services.palm_gallery import palm_gallery
 
-# Create Database Tables
+# Create Database Tables (and columns added since the DB was created)
 Base.metadata.create_all(bind=engine)
+add_missing_columns(engine)
 
 app = FastAPI(
     title="Zero Trust Biometric API",
@@ -23,6 +27,24 @@ app.add_middleware(
 
 app.include_router(auth.router)
 
+@app.on_event("startup")
+def load_iris_gallery():
+    # 1:N identification gallery (updated incrementally on enrollment)
+    db = SessionLocal()
+    try:
+        iris_gallery.load_from_db(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def load_palm_gallery():
+    # 1:N palm gallery + vocabulary tree (updated incrementally on enrollment)
+    db = SessionLocal()
+    try:
+        palm_gallery.load_from_db(db)
+    finally:
+        db.close()
+
 @app.get("/")
 def read_root():
     return {"status": "System Operational", "mode": "Zero Trust Active"}
@@ -0,0 +1,94 @@
+"""
+Schema and data migrations for existing biosec.db files.
+
+Usage (from the project root):
+    python -m backend.migrations [--batch-size 500]
+"""
+
+import argparse
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import load_only
+
+from . import models, database
+from .services import iris_template
+
+# Columns added after the first release: (table, column, SQLite type).
+# create_all() only creates missing tables, so these are added by hand.
+ADDED_COLUMNS = [
+    ("biometric_templates", "iris_template", "BLOB"),
+    ("biometric_templates", "iris_adaptive", "BOOLEAN DEFAULT 0"),
+    ("biometric_templates", "iris_counters", "BLOB"),
+    ("biometric_templates", "iris_adapted_at", "DATETIME"),
+]
+
+
+def add_missing_columns(engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, column, sql_type in ADDED_COLUMNS:
+            if not inspector.has_table(table):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}"))
+                print(f"[Migrate] Added column {table}.{column}")
+
+
+def migrate_iris_templates(db, batch_size=500):
+    """
+    Stream legacy JSON iris templates out of biohash_data into the binary
+    iris_template column. Walks ids in order, one transaction per batch.
+    """
+    Template = models.BiometricTemplate
+    converted = failed = 0
+    last_id = 0
+
+    while True:
+        rows = (
+            db.query(Template)
+            .options(load_only(Template.id, Template.biohash_data, Template.iris_template))
+            .filter(Template.id > last_id)
+            .filter(Template.iris_template.is_(None))
+            .filter(Template.biohash_data.like("{%"))
+            .order_by(Template.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+
+        for row in rows:
+            last_id = row.id
+            try:
+                row.iris_template = iris_template.from_legacy_json(row.biohash_data)
+                row.biohash_data = "EMPTY"
+                converted += 1
+            except Exception as e:
+                print(f"[Migrate] Template {row.id} skipped: {e}")
+                failed += 1
+
+        db.commit()
+        db.expunge_all() # Keep memory flat across batches
+        print(f"[Migrate] Iris templates: {converted} converted, {failed} skipped (last id {last_id})")
+
+    return converted, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate biosec.db to the current schema")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    add_missing_columns(database.engine)
+
+    db = database.SessionLocal()
+    try:
+        migrate_iris_templates(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, LargeBinary, Boolean
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -28,9 +28,18 @@ class BiometricTemplate(Base):
     # The secret token/seed used for BioHashing (Keep secret!)
     seed_token = Column(Integer, nullable=False)
     
-    # Face BioHash
+    # Face BioHash (legacy: also held JSON iris templates before iris_template existed)
     biohash_data = Column(String, nullable=False)
 
+    # Iris Cancelable Code (binary, versioned: see services/iris_template.py)
+    iris_template = Column(LargeBinary, nullable=True)
+
+    # Opt-in online adaptation: int8 per-bit vote counters (cancelled domain)
+    # and the time of the last update (rate limit). See services/iris_adaptation.py
+    iris_adaptive = Column(Boolean, default=False)
+    iris_counters = Column(LargeBinary, nullable=True)
+    iris_adapted_at = Column(DateTime, nullable=True)
+
     # Fingerprint Fuzzy Vault (Stored as JSON string)
     fingerprint_vault = Column(String, nullable=True)
 
@@ -0,0 +1,209 @@
+"""
+Bulk seed rotation (template revocation) for iris templates.
+
+A cancelable iris template is stored = code[P] ^ M, with (P, M) derived from
+the user's seed_token. Re-keying to a new seed needs no raw image:
+    Q      = inv(P_old)[P_new]
+    stored = stored_old[Q] ^ (M_old[Q] ^ M_new)
+(the reliability mask section is only permuted: mask = mask_old[Q]; the
+coarse cascade section is re-keyed the same way with its own 8x90 tables,
+and always ends up under ALGO_BLOCKSHIFT_KEYED ones).
+Online adaptation counters (signed votes per stored bit) follow Q and flip
+sign where the bit is re-masked: counters = counters_old[Q] * (1 - 2 * XOR).
+For SEALED_ALGOS the mask section and the counters are also XOR-ed with
+keyed pads (TransformCache.section_pads): unsealed with the old seed's pads
+first, sealed with the new seed's after.
+
+ALGO_BLOCKSHIFT templates (tiled XOR mask: linkable across seeds) are moved
+to ALGO_BLOCKSHIFT_KEYED on the way: P_old / P_new and the masks just come
+from the two algorithms' tables.
+
+Usage (from the project root):
+    python -m backend.rekey_iris_templates [--batch-size 500]
+
+Restart the API afterwards (or reload the gallery) so 1:N search sees the new codes.
+"""
+
+import argparse
+import secrets
+import time
+
+import numpy as np
+from sqlalchemy.orm import load_only
+
+from . import models, database
+from .services import hamming
+from .services import iris_template
+from .services.transform_cache import TransformCache
+
+MAX_SEED = 2**31 - 1 # seed_token is an Integer column (and RandomState needs < 2**32)
+
+# Algorithms re-keyed into a different one
+UPGRADES = {iris_template.ALGO_BLOCKSHIFT: iris_template.ALGO_BLOCKSHIFT_KEYED}
+
+
+def new_seed():
+    return secrets.randbelow(MAX_SEED - 1) + 1
+
+
+def rekey_tables(old_seed, new_seed, nbits, algo, new_algo=None):
+    """
+    (Q, XOR) mapping a template from old_seed to new_seed (and to new_algo).
+    """
+    old_perm, old_mask = TransformCache.build(old_seed, nbits, algo)
+    new_perm, new_mask = TransformCache.build(new_seed, nbits, new_algo or algo)
+
+    inverse = np.empty_like(old_perm)
+    inverse[old_perm] = np.arange(nbits)
+    compose = inverse[new_perm]
+    return compose, np.bitwise_xor(old_mask[compose], new_mask)
+
+
+def rekey_counters(counters_blob, old_seed, new_seed, nbits, algo):
+    """
+    Move online adaptation counters (int8 per stored bit) to new_seed.
+    """
+    new_algo = UPGRADES.get(algo, algo)
+    counters = np.frombuffer(counters_blob, dtype=np.uint8)
+    old_pads = TransformCache.section_pads(old_seed, nbits, algo)
+    if old_pads is not None:
+        counters = counters ^ old_pads[1]
+
+    compose, xor = rekey_tables(old_seed, new_seed, nbits, algo, new_algo)
+    counters = (counters.view(np.int8)[compose] * (1 - 2 * xor.astype(np.int8))).astype(np.int8).view(np.uint8)
+
+    new_pads = TransformCache.section_pads(new_seed, nbits, new_algo)
+    if new_pads is not None:
+        counters = counters ^ new_pads[1]
+    return counters.tobytes()
+
+
+def rekey_batch(templates, old_seeds, new_seeds):
+    """
+    Re-key parsed IrisTemplates sharing (algo, nbits) in one vectorized pass.
+    Returns the new binary templates.
+    """
+    algo, nbits = templates[0].algo, templates[0].nbits
+    new_algo = UPGRADES.get(algo, algo)
+    tables = [rekey_tables(old, new, nbits, algo, new_algo) for old, new in zip(old_seeds, new_seeds)]
+    compose = np.stack([t[0] for t in tables])
+    xor = np.stack([t[1] for t in tables])
+
+    # 1. Permute + re-mask every code at once
+    bits = hamming.unpack_words(np.stack([t.words for t in templates]), nbits)
+    codes = hamming.pack_bits(np.take_along_axis(bits, compose, axis=1) ^ xor)
+
+    # 2. Reliability masks only follow the permutation (unsealed, then resealed)
+    masks = [None] * len(templates)
+    with_mask = [i for i, t in enumerate(templates) if t.mask is not None]
+    if with_mask:
+        mask_words = np.stack([templates[i].mask for i in with_mask])
+        if algo in iris_template.SEALED_ALGOS:
+            mask_words = mask_words ^ np.stack([TransformCache.section_pads(old_seeds[i], nbits, algo)[0] for i in with_mask])
+        mask_bits = hamming.unpack_words(mask_words, nbits)
+        packed = hamming.pack_bits(np.take_along_axis(mask_bits, compose[with_mask], axis=1))
+        if new_algo in iris_template.SEALED_ALGOS:
+            packed ^= np.stack([TransformCache.section_pads(new_seeds[i], nbits, new_algo)[0] for i in with_mask])
+        for i, m in zip(with_mask, packed):
+            masks[i] = m
+
+    # 3. Coarse cascade codes: BlockShift on the coarse grid, moved to the keyed tables
+    coarse = [None] * len(templates)
+    with_coarse = [i for i, t in enumerate(templates) if t.coarse is not None]
+    if with_coarse:
+        n_coarse = iris_template.COARSE_BITS
+        coarse_tables = [
+            rekey_tables(old_seeds[i], new_seeds[i], n_coarse, templates[i].coarse_algo, iris_template.ALGO_BLOCKSHIFT_KEYED)
+            for i in with_coarse
+        ]
+        coarse_bits = hamming.unpack_words(np.stack([templates[i].coarse for i in with_coarse]), n_coarse)
+        packed = hamming.pack_bits(
+            np.take_along_axis(coarse_bits, np.stack([t[0] for t in coarse_tables]), axis=1)
+            ^ np.stack([t[1] for t in coarse_tables])
+        )
+        for i, c in zip(with_coarse, packed):
+            coarse[i] = c
+
+    return [
+        iris_template.encode(code, nbits, new_algo, flags=iris_template.FLAG_COARSE_KEYED if c is not None else 0, mask=mask, coarse=c)
+        for code, mask, c in zip(codes, masks, coarse)
+    ]
+
+
+def rekey_iris_templates(db, batch_size=500):
+    """
+    Walk every BiometricTemplate with an iris code (ids in order) and move it
+    to a fresh seed_token. One transaction per batch.
+    """
+    Template = models.BiometricTemplate
+    total = (
+        db.query(Template)
+        .filter(Template.iris_template.isnot(None) | Template.biohash_data.like("{%"))
+        .count()
+    )
+    rekeyed = failed = 0
+    last_id = 0
+    start = time.perf_counter()
+
+    while True:
+        rows = (
+            db.query(Template)
+            .options(load_only(Template.id, Template.seed_token, Template.biohash_data, Template.iris_template, Template.iris_counters))
+            .filter(Template.id > last_id)
+            .filter(Template.iris_template.isnot(None) | Template.biohash_data.like("{%"))
+            .order_by(Template.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        # 1. Parse, grouped by code geometry (normally a single group)
+        groups = {}
+        for row in rows:
+            try:
+                template = iris_template.load(iris_template.pick_stored(row.iris_template, row.biohash_data))
+                if template.algo not in iris_template.ALGO_NAMES:
+                    raise ValueError(f"Unknown algo {template.algo}")
+                groups.setdefault((template.algo, template.nbits), []).append((row, template))
+            except Exception as e:
+                print(f"[Rekey] Template {row.id} skipped: {e}")
+                failed += 1
+
+        # 2. Re-key each group, then swap seed + template together
+        for members in groups.values():
+            seeds = [new_seed() for _ in members]
+            blobs = rekey_batch([t for _, t in members], [row.seed_token for row, _ in members], seeds)
+            for (row, template), seed, blob in zip(members, seeds, blobs):
+                if row.iris_counters:
+                    row.iris_counters = rekey_counters(row.iris_counters, row.seed_token, seed, template.nbits, template.algo)
+                row.iris_template = blob
+                row.biohash_data = "EMPTY"
+                row.seed_token = seed # Also drops the old tables from transform_cache
+                rekeyed += 1
+
+        db.commit()
+        db.expunge_all() # Keep memory flat across batches
+
+        elapsed = time.perf_counter() - start
+        print(f"[Rekey] {rekeyed + failed}/{total} processed, {rekeyed} re-keyed, {failed} skipped "
+              f"({rekeyed / max(elapsed, 1e-9):.0f} templates/s, last id {last_id})")
+
+    return rekeyed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-key every iris template to a fresh seed_token")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    db = database.SessionLocal()
+    try:
+        rekey_iris_templates(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from .. import models, schemas, database
 from ..services.context import ContextService
 from ..services.palm_service import PalmService
+from ..services.iris_cancelable_service import IrisCancelableService
+from ..services.iris_gallery import iris_gallery
+from ..services.palm_gallery import palm_gallery
+from ..services import iris_template
+from ..services import image_io
+from ..services.quality import quality_gate
+from ..services.liveness import pad_filter
+from ..services.iris_adaptation import template_adapter
 import json
 import numpy as np
+from datetime import datetime
+from typing import List
 
 router = APIRouter(
     prefix="/auth",
@@ -18,7 +29,67 @@ biometric_service = None # Removed
 context_service = ContextService()
 cnn_service = None # Removed
 iom_service = None # Removed
-palm_service = PalmService()
+palm_service = PalmService() # PALM_MATCHER ("bf" default, "lsh" opt-in), PALM_GEOMETRIC=1 (RANSAC stage, opt-in)
+
+def retake_response(username, modality, reason, metrics, spoof=False):
+    """
+    Fast reject from the capture quality gate or the presentation-attack
+    filter: no feature extraction was run.
+    """
+    prefix = "REJECTED" if spoof else "RETAKE"
+    return {
+        "authenticated": False,
+        "username": username,
+        "message": f"{prefix} ({modality}): {reason}",
+        "quality": metrics
+    }
+
+def screen_capture(image_bytes, modality):
+    """
+    Quality gate, then presentation-attack filter. One decode, at most 2x
+    reduced: the moire check needs (near) native pixels, the rest the
+    thumbnail. The working-size image it also yields goes to preprocess,
+    so the capture is not decoded again.
+    Returns (ok, metrics, reason, spoof, image).
+    """
+    work_width = IrisCancelableService.work_width if modality == "Iris" else PalmService.work_width
+    image, work = image_io.decode_gray_pair(image_bytes, work_width)
+    if image is None:
+        return False, {}, "Image Error", False, None
+    thumb = quality_gate.downscale(work)
+    assess = quality_gate.assess_iris if modality == "Iris" else quality_gate.assess_palm
+    ok, metrics, reason = assess(thumb)
+    if not ok:
+        return False, metrics, reason, False, work
+
+    ok, pad_metrics, reason = pad_filter.check(thumb, image)
+    metrics.update(pad_metrics)
+    return ok, metrics, reason, not ok, work
+
+def stored_iris_template(template):
+    if template is None:
+        return None
+    return iris_template.pick_stored(template.iris_template, template.biohash_data)
+
+def adapt_iris_template(db, template, iris_service, image_bytes, score):
+    """
+    Opt-in online adaptation after an accept: fold the capture into the
+    template's per-bit counters. Only well above threshold, rate limited.
+    """
+    now = datetime.utcnow()
+    if not template.iris_adaptive or not template_adapter.allowed(score, template.iris_adapted_at, now):
+        return False
+    adapted = iris_service.adapt(image_bytes, stored_iris_template(template), template.iris_counters, template.seed_token)
+    if adapted is None:
+        return False
+
+    template.iris_template, template.iris_counters = adapted
+    template.biohash_data = "EMPTY" # Legacy JSON codes move to the binary column
+    template.iris_adapted_at = now
+    db.commit()
+    iris_gallery.add(template.user_id, template.iris_template, template.seed_token)
+    print(f"[Adapt] Iris template of user {template.user_id} updated (score {score:.2f}).")
+    return True
 
 @router.post("/enroll", response_model=schemas.UserResponse)
 async def enroll_user(
@@ -26,8 +97,10 @@ async def enroll_user(
     username: str = Form(...),
     file_palm: UploadFile = File(None),    # Palm (Optional)
     file_iris: UploadFile = File(None),    # Iris (Optional)
+    file_iris_extra: List[UploadFile] = File(None), # Extra iris captures (fused at enrollment)
     device_id: str = Form(None),           # Zero Trust: Device Binding
     region: str = Form(None),              # Zero Trust: Home Region
+    iris_adaptive: bool = Form(False),     # Opt-in: refine the iris template on confident accepts
     db: Session = Depends(database.get_db)
 ):
     existing_user = db.query(models.User).filter(models.User.username == username).first()
@@ -37,6 +110,7 @@ async def enroll_user(
     # 1. Cancelable Token
     secret_token = 123456 # Fixed for simulation or random
     biohash_str = "EMPTY" 
+    iris_blob = None
     vault_json = None
 
     # 4. Process Palm (ORB/AKAZE Feature Matching)
@@ -54,15 +128,15 @@ async def enroll_user(
     if file_iris:
         from ..services.iris_cancelable_service import IrisCancelableService
         iris_svc = IrisCancelableService()
-        i_bytes = await file_iris.read()
+        captures = [await file_iris.read()]
+        for extra in file_iris_extra or []:
+            captures.append(await extra.read())
         
-        # Reuse the user's secret token
-        iris_template = iris_svc.create_template(i_bytes, secret_token)
-        if iris_template:
-            # For testing: If Face is missing or we want to force Iris, store in biohash_data
-            # Store Iris template in biohash_data field
-            biohash_str = iris_template
-            print(f"[Enroll] Iris Template Created.")
+        # Reuse the user's secret token (several captures -> one majority-vote code)
+        iris_blob = iris_svc.create_fused_template(captures, secret_token)
+        if iris_blob:
+            # Binary template in its own column (biohash_data stays "EMPTY")
+            print(f"[Enroll] Iris Template Created ({len(captures)} capture(s)).")
         else:
             print(f"[Enroll] Iris Template Failed.")
 
@@ -82,6 +156,8 @@ async def enroll_user(
         user_id=new_user.id,
         seed_token=secret_token,
         biohash_data=biohash_str,
+        iris_template=iris_blob,
+        iris_adaptive=bool(iris_blob) and iris_adaptive,
         fingerprint_vault=vault_json,
         palm_vault=palm_vault_json,
         # iris_vault=iris_vault_json # Add to model if needed, or reuse a field
@@ -89,12 +165,19 @@ async def enroll_user(
     db.add(new_template)
     db.commit()
 
+    # Keep the 1:N galleries in sync
+    if iris_blob:
+        iris_gallery.add(new_user.id, iris_blob, secret_token)
+    if palm_vault_json:
+        palm_gallery.add(new_user.id, palm_vault_json)
+
     return {"id": new_user.id, "username": new_user.username, "message": "User enrolled (Palm+Iris Ready)"}
     
 @router.post("/verify/iris", response_model=schemas.AuthResponse)
 async def verify_iris(
     username: str = Form(...),
     file_iris: UploadFile = File(...),
+    device_id: str = Form(None),           # Remembered shifts are per device
     db: Session = Depends(database.get_db)
 ):
     from ..services.iris_cancelable_service import IrisCancelableService
@@ -106,43 +189,207 @@ async def verify_iris(
         raise HTTPException(status_code=401, detail="User not found")
     template = db.query(models.BiometricTemplate).filter(models.BiometricTemplate.user_id == user.id).first()
     
-    # Check if we have an iris template stored. 
-    # Currently we didn't add an explicit column for Iris in `models.py`.
-    # We stored Face BioHash in `biohash_data` (String).
-    # Since Face is effectively disabled/optional, we *could* store Iris there, distinct by format?
-    # Or cleaner: Add `iris_code` to BiometricTemplate.
-    # For now, let's assume we repurposed `biohash_data` OR just verify logic.
+    # Binary iris_template column, or legacy JSON in biohash_data
+    stored = stored_iris_template(template)
     
-    # Since we are in a "Palm Test" phase and moving to Iris, 
-    # let's assume `biohash_data` holds the Iris Cancelable Code if it's JSON.
-    # Face BioHash was typically a Hex String.
-    
-    stored = template.biohash_data
-    is_json = stored.startswith("{")
-    
-    if not is_json:
+    if stored is None:
          return {"authenticated": False, "username": username, "message": "No Iris Template Found (Old Face Data?)"}
 
     # 2. Verify
     img_bytes = await file_iris.read()
     
+    # Cheap quality gate + spoof filter before preprocess + Gabor
+    ok, metrics, reason, spoof, img = screen_capture(img_bytes, "Iris")
+    if not ok:
+        return retake_response(username, "Iris", reason, metrics, spoof)
+    
     # Threshold 59 from latest benchmark (FAR 0.00%, FRR 46%)
     # This provides high security (no imposters) but may require multiple attempts (high FRR).
-    is_match, score, msg = iris_service.verify(img_bytes, stored, template.seed_token)
+    is_match, score, msg = iris_service.verify(img, stored, template.seed_token, history_key=(user.id, device_id))
     
     # Override service default if needed, though verify returns is_match based on internal logic.
     # We should ensure service.verify uses T=59 or logic is consistent.
     # Service verify uses: is_match = best_score > 60. 
     # Let's align it here.
     is_match = score > 59
+
+    if is_match:
+        adapt_iris_template(db, template, iris_service, img, score)
     
     status = "ACCESS GRANTED" if is_match else "ACCESS DENIED"
     return {
         "authenticated": is_match, 
         "username": username, 
-        "message": f"{status} (Iris) [Score: {score:.2f}]"
+        "message": f"{status} (Iris) [Score: {score:.2f}]",
+        "early_exit": msg == "Matched (early exit)"
     }
 
+@router.post("/identify/iris", response_model=schemas.AuthResponse)
+async def identify_iris(
+    file_iris: UploadFile = File(...),
+    db: Session = Depends(database.get_db)
+):
+    """
+    1:N identification: no username, the probe is scored against every enrolled iris.
+    """
+    iris_service = IrisCancelableService()
+    img_bytes = await file_iris.read()
+    
+    ok, metrics, reason, spoof, img = screen_capture(img_bytes, "Iris")
+    if not ok:
+        return retake_response(None, "Iris", reason, metrics, spoof)
+    
+    user_id, score, is_match = iris_service.identify(img, iris_gallery)
+    
+    # 1:1 threshold tightened for the gallery size (IrisGallery.threshold)
+    user = db.query(models.User).filter(models.User.id == user_id).first() if is_match else None
+    if user is None:
+        return {"authenticated": False, "message": f"ACCESS DENIED (Iris 1:N) [Best Score: {score:.2f}]"}
+    
+    return {
+        "authenticated": True,
+        "username": user.username,
+        "message": f"ACCESS GRANTED (Iris 1:N) [Score: {score:.2f}]"
+    }
+
+@router.post("/identify/palm", response_model=schemas.AuthResponse)
+async def identify_palm(
+    file_palm: UploadFile = File(...),
+    db: Session = Depends(database.get_db)
+):
+    """
+    1:N identification: no username, TF-IDF shortlist then full palm matching.
+    """
+    palm_bytes = await file_palm.read()
+    
+    ok, metrics, reason, spoof, img = screen_capture(palm_bytes, "Palm")
+    if not ok:
+        return retake_response(None, "Palm", reason, metrics, spoof)
+    
+    user_id, score, is_match = palm_service.identify(img, palm_gallery)
+    
+    # Same threshold as 1:1 verification of the best candidate's template
+    user = db.query(models.User).filter(models.User.id == user_id).first() if is_match else None
+    if user is None:
+        return {"authenticated": False, "message": f"ACCESS DENIED (Palm 1:N) [Best Keypoints: {score}]"}
+    
+    return {
+        "authenticated": True,
+        "username": user.username,
+        "message": f"ACCESS GRANTED (Palm 1:N) [Keypoints: {score}]"
+    }
+
+# Capture stream limits (per connection)
+STREAM_MAX_FRAMES = 60 # Frames accepted before giving up
+STREAM_MAX_VERIFIES = 3 # Full preprocess + Gabor verifications
+
+def stream_user(db, username):
+    """
+    (user, template) for a stream hello, either None if not found.
+    """
+    user = db.query(models.User).filter(models.User.username == username).first()
+    template = db.query(models.BiometricTemplate).filter(models.BiometricTemplate.user_id == user.id).first() if user else None
+    return user, template
+
+@router.websocket("/stream/iris")
+async def stream_iris(websocket: WebSocket, db: Session = Depends(database.get_db)):
+    """
+    Iris capture stream with incremental best-frame selection.
+    1. Client sends {"username": ..., "device_id": ...} (device_id optional);
+       anything else closes the stream with 1003 (unsupported data)
+    2. Then low-resolution frames as binary messages. Each one only gets the
+       cheap quality gate; the sharpest frame so far is tracked.
+    3. A frame that passes quality and is sharper than the last one tried runs
+       the full verify. The stream ends on the first match.
+    4. Text "done" (or the frame / verify budget running out) ends the stream.
+    Every frame gets a JSON reply: "retake" / "continue", then "granted" / "denied"
+    ("rejected" as soon as a frame looks like a presentation attack).
+    """
+    await websocket.accept()
+    try:
+        try:
+            hello = await websocket.receive_json()
+            username = hello["username"]
+        except (ValueError, KeyError, TypeError):
+            # Not JSON, not an object, or no username: unsupported data
+            await websocket.close(code=1003)
+            return
+
+        # 1. Retrieve User + template once per stream (sync ORM: off the event loop)
+        user, template = await run_in_threadpool(stream_user, db, username)
+        stored = stored_iris_template(template)
+        if stored is None:
+            await websocket.send_json({"status": "error", "message": "User or Iris Template not found"})
+            await websocket.close()
+            return
+
+        iris_service = IrisCancelableService()
+        best_metrics, best_focus = {}, -1.0
+        verified_focus = -1.0
+        verifies = 0
+        best_score = 0.0
+
+        for _ in range(STREAM_MAX_FRAMES):
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            frame = message.get("bytes")
+            if frame is None:
+                if message.get("text") == "done":
+                    break
+                continue
+
+            # 2. Cheap gate on every frame
+            ok, metrics, reason, spoof, img = await run_in_threadpool(screen_capture, frame, "Iris")
+            if spoof:
+                # A replayed / printed frame ends the stream
+                await websocket.send_json({"status": "rejected", "reason": reason, "quality": metrics})
+                await websocket.close()
+                return
+            focus = metrics.get("focus", 0.0)
+            if focus > best_focus:
+                best_focus, best_metrics = focus, metrics
+            if not ok:
+                await websocket.send_json({"status": "retake", "reason": reason, "quality": metrics})
+                continue
+            if focus <= verified_focus:
+                await websocket.send_json({"status": "continue", "reason": "Not sharper than the last attempt", "quality": metrics})
+                continue
+
+            # 3. Full verification on a new best frame
+            verified_focus = focus
+            verifies += 1
+            _, score, msg = await run_in_threadpool(
+                iris_service.verify, img, stored, template.seed_token, history_key=(user.id, hello.get("device_id"))
+            )
+            best_score = max(best_score, score)
+            if score > 59: # Same threshold as /verify/iris
+                await websocket.send_json({
+                    "status": "granted",
+                    "authenticated": True,
+                    "username": username,
+                    "message": f"ACCESS GRANTED (Iris stream) [Score: {score:.2f}]",
+                    "quality": metrics,
+                    "early_exit": msg == "Matched (early exit)"
+                })
+                await websocket.close()
+                return
+            if verifies >= STREAM_MAX_VERIFIES:
+                break
+            await websocket.send_json({"status": "continue", "reason": "No match yet", "score": score, "quality": metrics})
+
+        # 4. Out of frames / attempts
+        await websocket.send_json({
+            "status": "denied",
+            "authenticated": False,
+            "username": username,
+            "message": f"ACCESS DENIED (Iris stream) [Best Score: {best_score:.2f}]",
+            "quality": best_metrics
+        })
+        await websocket.close()
+    except WebSocketDisconnect:
+        print(f"[Stream] Client disconnected.")
+
 # Face and Finger endpoints removed.
 
 @router.post("/verify/palm", response_model=schemas.AuthResponse)
@@ -163,9 +410,14 @@ async def verify_palm(
     # 2. Palm Check via ORB
     palm_bytes = await file_palm.read()
     
+    # Cheap quality gate + spoof filter before AKAZE
+    ok, metrics, reason, spoof, img = screen_capture(palm_bytes, "Palm")
+    if not ok:
+        return retake_response(username, "Palm", reason, metrics, spoof)
+    
     # PalmService handles deserialization and matching logic internally
     # It compares live ORB descriptors vs Stored ones
-    is_match, score_count, msg = palm_service.verify(palm_bytes, template.palm_vault)
+    is_match, score_count, msg = palm_service.verify(img, template.palm_vault)
     
     status = "ACCESS GRANTED" if is_match else "ACCESS DENIED"
     return {
@@ -214,28 +466,10 @@ async def verify_zerotrust(
     from ..services.iris_cancelable_service import IrisCancelableService
     iris_service = IrisCancelableService()
 
-    # 2. Iris Check (Primary)
-    iris_passed = False
-    iris_score = 0.0
-    if file_iris:
-        i_bytes = await file_iris.read()
-        # verify returns (is_match, score, msg)
-        # Note: We are using biohash_data for Iris now based on enroll_user logic
-        if template.biohash_data:
-             is_m, score, _ = iris_service.verify(i_bytes, template.biohash_data, template.seed_token)
-             iris_passed = (score > 59) # Threshold 59
-             iris_score = score
-    
-    # 3. Palm Check (Secondary)
-    palm_passed = False
-    palm_score = 0
-    if file_palm and template.palm_vault:
-        p_bytes = await file_palm.read()
-        is_m, score, _ = palm_service.verify(p_bytes, template.palm_vault)
-        palm_passed = is_m
-        palm_score = score # Keypoints count
-        
-    # 4. Context Check
+    i_bytes = await file_iris.read() if file_iris else None
+    p_bytes = await file_palm.read() if file_palm else None
+
+    # 1b. Context Check (first, so capture rejects are logged with it)
     
     # Handle Mock IP
     eff_request = request
@@ -254,8 +488,38 @@ async def verify_zerotrust(
         mock_hour=mock_hour
     )
     context_passed = (context_score >= 0.7) if strict_context else True
+
+    # 1c. Capture Quality Gate + spoof filter (before any matching)
+    decoded = {} # Modality -> working-size image, reused by verify
+    for modality, data in (("Iris", i_bytes), ("Palm", p_bytes)):
+        if data is None:
+            continue
+        ok, metrics, reason, spoof, decoded[modality] = screen_capture(data, modality)
+        if not ok:
+            response = retake_response(username, modality, reason, metrics, spoof)
+            context_service.log_access(db, user.id, request.client.host, context_score, response["message"])
+            return response
+
+    # 2. Iris Check (Primary)
+    iris_passed = False
+    iris_score = 0.0
+    if file_iris:
+        # verify returns (is_match, score, msg)
+        stored = stored_iris_template(template)
+        if stored is not None:
+             is_m, score, _ = iris_service.verify(decoded["Iris"], stored, template.seed_token, history_key=(user.id, device_id))
+             iris_passed = (score > 59) # Threshold 59
+             iris_score = score
+    
+    # 3. Palm Check (Secondary)
+    palm_passed = False
+    palm_score = 0
+    if file_palm and template.palm_vault:
+        is_m, score, _ = palm_service.verify(decoded["Palm"], template.palm_vault)
+        palm_passed = is_m
+        palm_score = score # Keypoints count
     
-    # 5. Fusion Logic
+    # 4. Fusion Logic
     # Requirement: Iris AND/OR Palm + Context.
     # If file provided, must pass.
     
@@ -286,6 +550,14 @@ async def verify_zerotrust(
         "message": f"{status} [{details}]"
     }
 
+@router.get("/metrics/pad")
+async def pad_metrics():
+    """
+    Presentation-attack filter counters: checks, rejects by reason (would-be
+    rejects while PAD_ENFORCE is off), average cost.
+    """
+    return pad_filter.stats()
+
 @router.post("/simulate-attack")
 async def simulate_attack(attack_type: str = Form("all")):
     """
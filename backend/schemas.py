@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Dict
 
 class UserCreate(BaseModel):
     username: str
@@ -16,3 +16,5 @@ class AuthResponse(BaseModel):
     authenticated: bool
     username: Optional[str] = None
     message: str
+    quality: Optional[Dict[str, float]] = None # Capture metrics on a RETAKE response
+    early_exit: Optional[bool] = None # Iris shift search stopped at the first accepted shift
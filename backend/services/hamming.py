@@ -0,0 +1,159 @@
+"""
+Packed-word Hamming distance engine for binary iris codes.
+
+Codes are kept as rows of uint64 words (np.packbits order, zero padded)
+and compared with XOR + popcount instead of unpacking to one byte per bit.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+WORD_BITS = 64
+
+# Daugman's sqrt(n / n_ref) assumes independent bits; the stable bits a
+# reliability mask keeps are not, and with sqrt 25%-masked impostors still
+# passed score 59 twice as often as unmasked ones (synthetic eyes). 0.75
+# brings them back to the unmasked rate.
+MASKED_RESCALE_POWER = 0.75
+
+# Popcount of every byte value (fallback for NumPy < 2.0)
+_POPCOUNT_LUT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def n_words(nbits):
+    return (nbits + WORD_BITS - 1) // WORD_BITS
+
+
+def popcount(words):
+    """
+    Number of set bits per element of a uint64 array.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    as_bytes = words.view(np.uint8).reshape(words.shape + (8,))
+    return _POPCOUNT_LUT[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+
+def pack_bits(bits):
+    """
+    (..., nbits) array of 0/1 -> (..., n_words) uint64 array.
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    return as_words(np.packbits(bits, axis=-1), bits.shape[-1])
+
+
+def as_words(packed, nbits):
+    """
+    View np.packbits output (..., nbytes) as uint64 words.
+    Zero-copy when the byte count is already a multiple of 8; otherwise pads.
+    Bits past `nbits` are cleared so they never count as differences.
+    """
+    packed = np.asarray(packed, dtype=np.uint8)
+    width = n_words(nbits) * 8
+    if packed.shape[-1] != width:
+        padded = np.zeros(packed.shape[:-1] + (width,), dtype=np.uint8)
+        padded[..., :min(width, packed.shape[-1])] = packed[..., :width]
+        packed = padded
+    elif nbits % 8:
+        packed = packed.copy()
+
+    if nbits % 8:
+        # Clear trailing bits of the last used byte (packbits is MSB first)
+        last = nbits // 8
+        packed[..., last] &= np.uint8((0xFF << (8 - nbits % 8)) & 0xFF)
+        packed[..., last + 1:] = 0
+
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def unpack_words(words, nbits):
+    """
+    Inverse of pack_bits.
+    """
+    return np.unpackbits(words.view(np.uint8), axis=-1)[..., :nbits]
+
+
+def hamming_distance(a, b, nbits, mask=None):
+    """
+    Normalized Hamming distance between packed codes.
+    Broadcasts over leading axes, so it covers:
+      1:1        a (W,)    b (W,)    -> scalar
+      shifts     a (S, W)  b (W,)    -> (S,)
+      gallery    a (W,)    b (N, W)  -> (N,)
+    With a packed `mask` (broadcastable to b), only masked bits are compared
+    and the distance is rescaled to the full code length (rescale_masked).
+    """
+    xor = np.bitwise_xor(a, b)
+    if mask is None:
+        return popcount(xor).sum(axis=-1, dtype=np.int64) / nbits
+
+    diff = popcount(np.bitwise_and(xor, mask)).sum(axis=-1, dtype=np.int64)
+    valid = popcount(mask).sum(axis=-1, dtype=np.int64)
+    return rescale_masked(diff / np.maximum(valid, 1), valid, nbits)
+
+
+def rescale_masked(dist, valid, n_ref):
+    """
+    Daugman score normalization: a distance over `valid` bits is pulled toward
+    0.5 by (valid / n_ref) ** MASKED_RESCALE_POWER, so masked comparisons are
+    held to thresholds calibrated on full n_ref-bit codes. valid == n_ref is
+    unchanged.
+    """
+    return 0.5 - (0.5 - dist) * (valid / n_ref) ** MASKED_RESCALE_POWER
+
+
+def hamming_cross(probes, templates, nbits, masks=None):
+    """
+    Every probe against every template: (S, W) x (N, W) -> (S, N).
+    `masks` (N, W) holds one reliability mask per template.
+    """
+    if masks is not None:
+        masks = masks[None, :, :]
+    return hamming_distance(probes[:, None, :], templates[None, :, :], nbits, masks)
+
+
+def distance_matrix(probes, templates=None, nbits=None, masks=None, tile=32, workers=None):
+    """
+    Blocked all-vs-all distances for evaluation: (N, W) x (M, W) -> (N, M).
+    probes may be (N, S, W) with S rotation variants each; the best (min) is kept.
+    templates defaults to the probes themselves (first variant) -> NxN.
+    masks: optional (M, W) reliability masks of the templates.
+
+    Works on tile x tile blocks so both operands stay cache resident; row
+    tiles run on a thread pool (NumPy releases the GIL in XOR / popcount).
+    """
+    probes = np.asarray(probes, dtype=np.uint64)
+    if probes.ndim == 2:
+        probes = probes[:, None, :]
+    # Without shifts the self-matrix is symmetric: only upper tiles are computed
+    symmetric = templates is None and probes.shape[1] == 1 and masks is None
+    if templates is None:
+        templates = probes[:, 0, :]
+    templates = np.asarray(templates, dtype=np.uint64)
+
+    n, n_shifts, w = probes.shape
+    m = len(templates)
+    if nbits is None:
+        nbits = w * WORD_BITS
+    out = np.empty((n, m), dtype=np.float64)
+
+    def run(i0):
+        block = probes[i0:i0 + tile]
+        for j0 in range(i0 if symmetric else 0, m, tile):
+            other = templates[j0:j0 + tile][None, :, :]
+            other_masks = None if masks is None else masks[j0:j0 + tile][None, :, :]
+
+            # One shift at a time keeps the temporaries tile x tile x W
+            best = hamming_distance(block[:, 0, None, :], other, nbits, other_masks)
+            for s in range(1, n_shifts):
+                np.minimum(best, hamming_distance(block[:, s, None, :], other, nbits, other_masks), out=best)
+
+            out[i0:i0 + len(block), j0:j0 + other.shape[1]] = best
+            if symmetric:
+                out[j0:j0 + other.shape[1], i0:i0 + len(block)] = best.T
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        list(pool.map(run, range(0, n, tile)))
+    return out
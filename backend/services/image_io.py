@@ -0,0 +1,137 @@
+"""
+Shared image ingestion: decode uploads straight to grayscale, near the size
+the caller works at.
+
+The image size is read from the JPEG / PNG header (no decode). JPEGs are
+then decoded with libjpeg DCT scaling (IMREAD_REDUCED_GRAYSCALE_2/4/8): the
+largest reduction that still leaves at least `min_width` columns, so a
+multi-megapixel upload never allocates its full-resolution frame. PNG has
+no DCT: OpenCV decodes it full size and downscales inside imdecode, which
+still skips the color decode and a full-size copy in the caller.
+
+imdecode applies the EXIF orientation, so for JPEGs carrying EXIF the
+smaller side has to satisfy `min_width` (the frame may be turned 90 degrees).
+"""
+
+import struct
+
+import cv2
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# (factor, flag), largest reduction first
+REDUCED_GRAYSCALE = [
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+]
+
+# JPEG start-of-frame markers (all except DHT, JPG and DAC)
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def probe(data):
+    """
+    (format, width, height, has EXIF) from the header of a JPEG or PNG, else None.
+    """
+    data = memoryview(data)
+    if len(data) >= 24 and data[:8] == PNG_SIGNATURE and data[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", width, height, False
+
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+
+    # Walk the JPEG segments up to the first start-of-frame
+    i = 2
+    exif = False
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF: # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9: # No length field
+            i += 2
+            continue
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        if marker == 0xE1 and data[i + 4:i + 8] == b"Exif":
+            exif = True
+        elif marker in _SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return "jpeg", width, height, exif
+        i += 2 + length
+    return None
+
+
+def reduction_factor(data, min_width=None):
+    """
+    The largest reduction (1, 2, 4 or 8) keeping >= min_width columns.
+    """
+    info = probe(data) if min_width else None
+    if info is not None:
+        fmt, width, height, exif = info
+        if exif:
+            width = min(width, height)
+        for factor, flag in REDUCED_GRAYSCALE:
+            # Floor: libjpeg rounds up, the PNG resize rounds down
+            if width // factor >= min_width:
+                return factor
+    return 1
+
+
+def reduction_flag(data, min_width=None):
+    """
+    imdecode flag: the largest reduction keeping >= min_width columns.
+    """
+    factor = reduction_factor(data, min_width)
+    return dict(REDUCED_GRAYSCALE).get(factor, cv2.IMREAD_GRAYSCALE)
+
+
+def decode_gray(image_bytes, min_width=None):
+    """
+    Grayscale image, at least `min_width` wide when the source is (callers
+    still resize to their exact working size). None if undecodable.
+    """
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    return cv2.imdecode(nparr, reduction_flag(image_bytes, min_width))
+
+
+def to_gray(image, min_width=None):
+    """
+    decode_gray for encoded bytes; an already decoded grayscale array is
+    returned as is.
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    return decode_gray(image, min_width)
+
+
+def decode_gray_pair(image_bytes, min_width, max_factor=2):
+    """
+    One decode, two sizes: (image reduced at most `max_factor` times,
+    ~decode_gray(image_bytes, min_width)), or (None, None) if undecodable.
+    The first is for checks that need near-native pixels, the second is
+    derived from it the way imdecode reduces (DCT block means for JPEG,
+    a linear resize for the rest). PNGs are decoded full size anyway.
+    """
+    factor = reduction_factor(image_bytes, min_width)
+    info = probe(image_bytes)
+    jpeg = info is not None and info[0] == "jpeg"
+    first = min(factor, max_factor) if jpeg else 1
+
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(nparr, dict(REDUCED_GRAYSCALE).get(first, cv2.IMREAD_GRAYSCALE))
+    if image is None or factor == first:
+        return image, image
+
+    h, w = image.shape
+    k = factor // first
+    if jpeg:
+        # libjpeg scaling averages each block and rounds the size up
+        return image, cv2.resize(image, (-(-w // k), -(-h // k)), interpolation=cv2.INTER_AREA)
+    return image, cv2.resize(image, (w // k, h // k), interpolation=cv2.INTER_LINEAR_EXACT)
@@ -0,0 +1,82 @@
+"""
+Opt-in online adaptation of iris templates.
+
+Every bit of the stored (cancelled) code gets a bounded int8 vote counter:
+positive votes for 1, negative for 0. High-confidence accepts add the
+aligned live code (in the same cancelled domain) as one vote per bit, and
+the active template is re-derived from the counters:
+  bit    = counter > 0
+  stable = |counter| among the most settled (reliability mask)
+The raw code never appears, so counters are as revocable as the template
+(re-keying permutes them and flips the sign where the XOR mask changes).
+Their magnitudes mirror the reliability mask, so for SEALED_ALGOS templates
+the service stores them XOR-ed with a keyed byte pad, like the mask section.
+
+Poisoning safeguards: updates only for scores well above the accept
+threshold, at most one update per `min_interval`, and counters that start
+at +/- `initial` so a bit needs several consistent votes to flip.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+
+from . import hamming
+
+
+class TemplateAdapter:
+    def __init__(self, min_score=80.0, min_interval=timedelta(hours=1), cap=16, initial=6, fragile_initial=1, min_confidence=2, fragile_fraction=0.25):
+        self.min_score = min_score # Route threshold is 59: only clear genuine accepts adapt
+        self.min_interval = min_interval
+        self.cap = cap # Counters saturate at +/- cap (int8)
+        self.initial = initial # Enrollment bits start this confident
+        self.fragile_initial = fragile_initial # ... masked (fragile) bits only this much
+        self.min_confidence = min_confidence # Never count a bit as stable below this
+        self.fragile_fraction = fragile_fraction
+
+    def allowed(self, score, last_update, now):
+        if score < self.min_score:
+            return False
+        return last_update is None or now - last_update >= self.min_interval
+
+    def initial_counters(self, template):
+        """
+        Counters equivalent to an existing template (code + optional mask).
+        """
+        bits = hamming.unpack_words(template.words, template.nbits).astype(np.int8)
+        strength = np.full(template.nbits, self.initial, dtype=np.int8)
+        if template.mask is not None:
+            stable = hamming.unpack_words(template.mask, template.nbits).astype(bool)
+            strength[~stable] = self.fragile_initial
+        return (2 * bits - 1) * strength
+
+    def load_counters(self, blob, template):
+        if blob:
+            counters = np.frombuffer(blob, dtype=np.int8)
+            if len(counters) == template.nbits:
+                return counters
+        return self.initial_counters(template)
+
+    def update(self, template, counters, live_words):
+        """
+        One vote per bit from an aligned live code (packed, cancelled domain).
+        `template` has an unsealed mask. Returns (packed code, packed
+        reliability mask, int8 counters): the caller seals and serializes them.
+        """
+        live = hamming.unpack_words(live_words, template.nbits).astype(np.int16)
+        counters = np.clip(counters.astype(np.int16) + 2 * live - 1, -self.cap, self.cap).astype(np.int8)
+
+        # A zero counter keeps the current bit instead of flipping on a tie
+        current = hamming.unpack_words(template.words, template.nbits).astype(bool)
+        bits = np.where(counters == 0, current, counters > 0).astype(np.uint8)
+
+        # Same share of masked bits as at enrollment: the least settled counters
+        confidence = np.abs(counters)
+        k = int(len(confidence) * self.fragile_fraction)
+        cutoff = np.partition(confidence, k)[k]
+        stable = (confidence >= max(cutoff, self.min_confidence)).astype(np.uint8)
+        return hamming.pack_bits(bits), hamming.pack_bits(stable), counters
+
+
+# Shared, stateless
+template_adapter = TemplateAdapter()
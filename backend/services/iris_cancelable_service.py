@@ -1,10 +1,26 @@
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
-import json
-import base64
+
+from .transform_cache import transform_cache
+from . import hamming
+from . import iris_template
+from .iris_normalizer import polar_normalizer
+from .pupil_locator import PupilLocator
+from .gabor_bank import GaborFilterBank
+from .shift_history import shift_history
+from .iris_adaptation import template_adapter
+from . import image_io
+
+# Same Gabor parameters as IrisCancelableService (theta=0 only)
+gabor_bank = GaborFilterBank(thetas=(0.0,), ksize=(31, 31), sigma=4.0, lambd=10.0, gamma=0.5, psi=0)
 
 class IrisCancelableService:
+    work_width = 400 # Preprocess resizes every capture to this width
+
     def __init__(self):
         # Parameters for Gabor Filter
         # Tuned for normalized iris
@@ -18,6 +34,36 @@ class IrisCancelableService:
             self.ksize, self.sigma, 0, self.lambd, self.gamma, self.psi, ktype=cv2.CV_32F
         )
 
+        # Rotation search: shift normalized strip by +/- 16 pixels
+        self.shifts = range(-16, 17, 4)
+
+        # Accept threshold (also ends an ordered shift search early)
+        self.early_accept = 60.0
+
+        # Fragile bits: this fraction of each code (weakest responses, closest
+        # to the median threshold) is masked out at enrollment
+        self.fragile_fraction = 0.25
+
+        # Multi-capture enrollment: a bit is stable only if this share of
+        # captures agree on it (2 captures: both, 3: two of three), with at
+        # most max_masked_fraction of the code masked in total. Unanimity over
+        # 3 captures masked 42% and doubled FRR; 2 captures masked up to 51%,
+        # past the range hamming.MASKED_RESCALE_POWER was fitted on.
+        self.min_agreement = 0.6
+        self.max_masked_fraction = 0.35
+
+        # Coarse cascade stage (8x90 code, iris_template.COARSE_GRID): strip
+        # downsampled 4x, smaller kernel. Coarse scores at or below reject end
+        # verify; the full code runs otherwise. Both bands come from synthetic
+        # eyes only, so the stage is reject-only unless IRIS_COARSE_ACCEPT
+        # (e.g. 85) is set once measured on real captures.
+        self.coarse_kernel = cv2.getGaborKernel((9, 9), 1.5, 0, 4.0, self.gamma, self.psi, ktype=cv2.CV_32F)
+        coarse_accept = os.getenv("IRIS_COARSE_ACCEPT")
+        self.coarse_accept = float(coarse_accept) if coarse_accept else None
+        self.coarse_reject = 57.0
+
+        self.pupil_locator = PupilLocator()
+
     def preprocess(self, image_bytes):
         """
         Robust Preprocessing:
@@ -25,60 +71,21 @@ class IrisCancelableService:
         2. Find Pupil (Darkest Cluster)
         3. Define Iris relative to Pupil
         4. Unwrap
+        Takes encoded bytes or an already decoded grayscale image.
         """
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+        # Decode straight to grayscale, JPEGs at a reduced scale >= target width
+        target_w = self.work_width
+        img = image_io.to_gray(image_bytes, target_w)
         if img is None: return None
 
         # Resize to fixed width (speed + consistency)
         h, w = img.shape
-        target_w = 400
         scale = target_w / w
         img_small = cv2.resize(img, (int(w*scale), int(h*scale)))
         
         # --- ROI Extraction ---
-        blurred = cv2.medianBlur(img_small, 9)
-        
-        hist = cv2.calcHist([blurred], [0], None, [256], [0, 256])
-        cdf = hist.cumsum()
-        total_pixels = img_small.shape[0] * img_small.shape[1]
-        threshold_val = 30
-        for i, count in enumerate(cdf):
-             if count > total_pixels * 0.05:
-                 threshold_val = i
-                 break
-        threshold_val = min(threshold_val, 60)
-        
-        _, thresh = cv2.threshold(blurred, threshold_val, 255, cv2.THRESH_BINARY_INV)
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        best_circle = (w//2, h//2, w//6)
-        best_score = 0
-        center_x, center_y = img_small.shape[1]//2, img_small.shape[0]//2
-        
-        for c in contours:
-            area = cv2.contourArea(c)
-            if area < 50: continue
-            if area > (total_pixels * 0.15): continue
-            
-            perimeter = cv2.arcLength(c, True)
-            if perimeter == 0: continue
-            circularity = 4 * np.pi * (area / (perimeter * perimeter))
-            
-            M = cv2.moments(c)
-            if M['m00'] == 0: continue
-            cx = int(M['m10']/M['m00'])
-            cy = int(M['m01']/M['m00'])
-            
-            dist_from_center = np.sqrt((cx - center_x)**2 + (cy - center_y)**2)
-            score = circularity * (1 - dist_from_center/w) * 2
-            
-            if score > best_score:
-                best_score = score
-                (x,y), radius = cv2.minEnclosingCircle(c)
-                best_circle = (int(x), int(y), int(radius))
-
-        px, py, pr = best_circle
+        # Coarse-to-fine pupil search (see pupil_locator.py)
+        px, py, pr = self.pupil_locator.locate(img_small)
         
         # --- Safe Radii Calculation ---
         dist_to_edge_x = min(px, img_small.shape[1] - px)
@@ -91,15 +98,9 @@ class IrisCancelableService:
         r_inner = int(pr + 2) 
         r_outer = int(ir - 2)
         
-        normalized = self.unwrap_iris(img_small, px, py, r_inner, r_outer)
-        
-        # --- Aggressive Cropping ---
-        # Keep only the middle 50%
-        final_h = normalized.shape[0]
-        crop_start = int(final_h * 0.25)
-        crop_end = int(final_h * 0.75)
-        
-        cropped = normalized[crop_start:crop_end, :]
+        # --- Unwrap + Aggressive Cropping ---
+        # Keep only the middle 50% (only those rows are sampled)
+        cropped = polar_normalizer.unwrap(img_small, px, py, r_inner, r_outer, crop=(0.25, 0.75))
         
         # Enhance
         clahe = cv2.createCLAHE(clipLimit=4.0, tileGridSize=(8,8))
@@ -108,19 +109,8 @@ class IrisCancelableService:
         return enhanced
 
     def unwrap_iris(self, img, cx, cy, r_inner, r_outer, width=360, height=64):
-        thetas = np.linspace(0, 2 * np.pi, width, endpoint=False)
-        radii = np.linspace(r_inner, r_outer, height, endpoint=False)
-        
-        theta_grid, radius_grid = np.meshgrid(thetas, radii)
-        
-        map_x = cx + radius_grid * np.cos(theta_grid)
-        map_y = cy + radius_grid * np.sin(theta_grid)
-        
-        map_x = map_x.astype(np.float32)
-        map_y = map_y.astype(np.float32)
-        
-        unwrapped = cv2.remap(img, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
-        return unwrapped
+        # Full strip (no crop), cached sampling grid
+        return polar_normalizer.unwrap(img, cx, cy, r_inner, r_outer, width, height, crop=(0.0, 1.0))
         
     def extract_raw_code(self, image_or_bytes):
         """
@@ -139,76 +129,462 @@ class IrisCancelableService:
         iris_code = (filtered > med).astype(np.uint8).flatten()
         return iris_code
 
-    def create_template(self, image_bytes, seed_token):
-        ra_code = self.extract_raw_code(image_bytes)
-        if ra_code is None: return None
+    def extract_raw_codes_batch(self, images_or_bytes, circular=False):
+        """
+        Bulk version of extract_raw_code (auto-enrollment, benchmarks).
+        All strips go through one batched FFT filter bank; the codes are
+        bit-identical to extract_raw_code, or with circular=True to
+        extract_circular_code (BlockShift templates, the current default).
+        Returns a list (None where preprocessing failed).
+        """
+        strips = [self.preprocess(x) if isinstance(x, bytes) else x for x in images_or_bytes]
+        valid = [i for i, strip in enumerate(strips) if strip is not None]
+        codes = [None] * len(strips)
+        if not valid:
+            return codes
+        
+        batch = gabor_bank.codes(np.stack([strips[i] for i in valid]), circular)
+        for i, code in zip(valid, batch):
+            codes[i] = code
+        return codes
+
+    def circular_response(self, img_norm):
+        """
+        Gabor response of the strip treated as a closed ring (columns wrap
+        around 360 degrees instead of reflecting at the seam).
+        """
+        half = self.ksize[1] // 2
+        w = img_norm.shape[1]
+        wrapped = np.hstack([img_norm[:, -half:], img_norm, img_norm[:, :half]])
+        return cv2.filter2D(wrapped, cv2.CV_32F, self.gabor_kernel)[:, half:half + w]
+
+    def extract_circular_code(self, img_norm):
+        """
+        Code for BlockShift templates: rolling the strip rolls this code exactly.
+        """
+        circular = self.circular_response(img_norm)
+        return (circular > np.median(circular)).astype(np.uint8).flatten()
+
+    def extract_shifted_codes(self, img_norm, shifts):
+        """
+        Single-pass rotation search.
+        Filters the strip once and derives the code of every rolled strip from
+        that response. Row i equals extract_raw_code(np.roll(img_norm, shifts[i], axis=1)).
+        """
+        half = self.ksize[1] // 2
+        h, w = img_norm.shape
+
+        # 1. Circular response: a rolled strip's interior columns are just
+        #    rolled columns of it
+        circular = self.circular_response(img_norm)
+
+        responses = np.empty((len(shifts), h, w), dtype=np.float32)
+        for i, s in enumerate(shifts):
+            responses[i] = np.roll(circular, s, axis=1)
+
+            # 2. Edge columns see the image border (not the wrap), so redo them
+            #    on thin slabs of the rolled strip
+            if s % w:
+                rolled = np.roll(img_norm, s, axis=1)
+                left = cv2.filter2D(rolled[:, :2 * half], cv2.CV_32F, self.gabor_kernel)
+                right = cv2.filter2D(rolled[:, -2 * half:], cv2.CV_32F, self.gabor_kernel)
+            else:
+                left = cv2.filter2D(img_norm[:, :2 * half], cv2.CV_32F, self.gabor_kernel)
+                right = cv2.filter2D(img_norm[:, -2 * half:], cv2.CV_32F, self.gabor_kernel)
+            responses[i, :, :half] = left[:, :half]
+            responses[i, :, -half:] = right[:, half:]
+
+        # 3. Binarize every shift at once
+        flat = responses.reshape(len(shifts), -1)
+        med = np.median(flat, axis=1)
+        return (flat > med[:, None]).astype(np.uint8)
+
+    def roll_blocks(self, words, shifts, grid=iris_template.BLOCKSHIFT_GRID):
+        """
+        BlockShift: rolling the strip by s px rolls the permuted (not yet
+        XOR-ed) code by whole blocks of packed bytes (a block covers 4 px of
+        the full strip, at either grid scale).
+        words: (..., n_words) -> (..., len(shifts), n_words).
+        """
+        rows, cols, block = grid
+        nbits = rows * cols
+        px_per_block = iris_template.BLOCKSHIFT_GRID[1] * block // cols
+        lead, q = words.shape[:-1], cols // block
+        blocks = words.view(np.uint8)[..., :nbits // 8].reshape(lead + (q, -1))
+
+        # Each shift is one contiguous window of the blocks written twice
+        doubled = np.concatenate([blocks, blocks], axis=-2)
+        out = np.empty(lead + (len(shifts),) + blocks.shape[-2:], dtype=np.uint8)
+        for k, s in enumerate(shifts):
+            step = (s // px_per_block) % q
+            out[..., k, :, :] = doubled[..., q - step:2 * q - step, :]
+        return hamming.as_words(out.reshape(lead + (len(shifts), -1)), nbits)
+
+    def blockshift_words(self, code, tables, shifts, grid=iris_template.BLOCKSHIFT_GRID):
+        """
+        Packed transformed code of every rotation shift of a circular code:
+        permute once, roll the blocks, then XOR (the keyed pad differs per
+        block, so it goes on after the roll). Returns (len(shifts), n_words).
+        """
+        perm, mask = tables
+        gathered = hamming.pack_bits(code[perm])
+        return np.bitwise_xor(self.roll_blocks(gathered, shifts, grid), hamming.pack_bits(mask))
+
+    def coarse_response(self, img_norm):
+        """
+        Circular Gabor response of the strip downsampled to the coarse grid.
+        4x4 area averaging: rolling the strip by 4 px rolls this by one column.
+        """
+        rows, cols, _ = iris_template.COARSE_GRID
+        small = cv2.resize(img_norm, (cols, rows), interpolation=cv2.INTER_AREA)
+        half = self.coarse_kernel.shape[1] // 2
+        wrapped = np.hstack([small[:, -half:], small, small[:, :half]])
+        return cv2.filter2D(wrapped, cv2.CV_32F, self.coarse_kernel)[:, half:half + cols]
+
+    def coarse_score(self, img_norm, template, seed_token):
+        """
+        Best coarse score (0-100) over all shifts, and the shift it came from.
+        """
+        response = self.coarse_response(img_norm)
+        code = (response > np.median(response)).astype(np.uint8).flatten()
+        tables = self.transform_tables(seed_token, iris_template.COARSE_BITS, template.coarse_algo)
+        rolled = self.blockshift_words(code, tables, self.shifts, iris_template.COARSE_GRID)
+        dists = hamming.hamming_distance(rolled, template.coarse, iris_template.COARSE_BITS)
+        best = int(np.argmin(dists))
+        return float((1.0 - dists[best]) * 100), self.shifts[best]
+
+    def reliability_mask(self, response):
+        """
+        1 = stable bit. Bits whose Gabor response sits closest to the median
+        threshold flip between captures and are left out of matching.
+        """
+        margin = np.abs(response - np.median(response)).flatten()
+        k = int(len(margin) * self.fragile_fraction)
+        cutoff = np.partition(margin, k)[k]
+        return (margin > cutoff).astype(np.uint8)
+
+    def cap_masked(self, stable, agreement, response):
+        """
+        At most max_masked_fraction of the bits masked: past that, the
+        masked bits the captures agree on most (then strongest response)
+        are restored.
+        """
+        keep = len(stable) - int(len(stable) * self.max_masked_fraction)
+        if np.count_nonzero(stable) >= keep:
+            return stable
+        margin = np.abs(response - np.median(response)).flatten()
+        order = np.lexsort((margin, agreement, stable)) # Ascending: best bits last
+        capped = np.zeros_like(stable)
+        capped[order[-keep:]] = 1
+        return capped
+
+    def create_template(self, image_bytes, seed_token, algo=iris_template.ALGO_BLOCKSHIFT_KEYED):
+        return self.create_fused_template([image_bytes], seed_token, algo)
+
+    def create_fused_template(self, captures, seed_token, algo=iris_template.ALGO_BLOCKSHIFT_KEYED):
+        """
+        Multi-capture enrollment: one majority-vote code from several captures.
+        1. Preprocess every capture in parallel
+        2. Align each strip to the first one with the shift search
+        3. Vote per bit (ties broken by the summed normalized response)
+        4. Keep as stable only bits the captures agree on and that are not
+           fragile, masking at most max_masked_fraction of the code
+        5. Same vote for the coarse cascade code
+        Same single-code template format as create_template.
+        """
+        with ThreadPoolExecutor(max_workers=min(len(captures), os.cpu_count() or 1)) as pool:
+            strips = [img for img in pool.map(self.preprocess, captures) if img is not None]
+        if not strips: return None
+
+        # Alignment on the circular codes (rolling the strip rolls them exactly)
+        ref = self.extract_circular_code(strips[0]).reshape(strips[0].shape)
+        aligned = [strips[0]]
+        for img in strips[1:]:
+            code = self.extract_circular_code(img).reshape(img.shape)
+            dists = [np.count_nonzero(np.roll(code, s, axis=1) != ref) for s in self.shifts]
+            aligned.append(np.roll(img, self.shifts[int(np.argmin(dists))], axis=1))
+
+        if algo in iris_template.BLOCKSHIFT_ALGOS:
+            ra_code, fused, votes = self.vote([self.circular_response(img) for img in aligned])
+        else:
+            ra_code, fused, votes = self.vote([cv2.filter2D(img, cv2.CV_32F, self.gabor_kernel) for img in aligned])
+
+        agreement = np.maximum(votes, 1.0 - votes)
+        stable = self.reliability_mask(fused) & (agreement >= self.min_agreement)
+        stable = self.cap_masked(stable, agreement, fused)
+        coarse_code, _, _ = self.vote([self.coarse_response(img) for img in aligned])
         
-        # Transform
-        transformed_code = self.cancelable_transform(ra_code, seed_token)
+        # Coarse code: keyed BlockShift whatever `algo` is (a tiled XOR mask
+        # would make every template linkable through this section)
         
-        # Serialize
-        packed = np.packbits(transformed_code)
-        b64_str = base64.b64encode(packed.tobytes()).decode('utf-8')
+        # Transform (the mask is only permuted, so it stays aligned with the code)
+        transformed_code = self.cancelable_transform(ra_code, seed_token, algo)
+        perm, _ = self.transform_tables(seed_token, len(ra_code), algo)
+        coarse = self.cancelable_transform(coarse_code, seed_token, iris_template.ALGO_BLOCKSHIFT_KEYED)
         
-        data = {
-            "shape": transformed_code.shape,
-            "b64": b64_str,
-            "algo": "BlockScramble_Gabor_ImgShift"
-        }
-        return json.dumps(data)
+        # Serialize (binary, versioned: see iris_template.py)
+        words = hamming.pack_bits(transformed_code)
+        return self.encode_template(
+            words, len(transformed_code), algo, seed_token,
+            mask=hamming.pack_bits(stable[perm]), coarse=hamming.pack_bits(coarse)
+        )
+
+    @staticmethod
+    def encode_template(words, nbits, algo, seed_token, mask=None, coarse=None, coarse_algo=iris_template.ALGO_BLOCKSHIFT_KEYED):
+        """
+        iris_template.encode, sealing the mask section of SEALED_ALGOS templates.
+        coarse_algo: tables the coarse code was transformed with.
+        """
+        pads = transform_cache.section_pads(seed_token, nbits, algo)
+        if pads is not None and mask is not None:
+            mask = np.bitwise_xor(mask, pads[0])
+        keyed = coarse is not None and coarse_algo == iris_template.ALGO_BLOCKSHIFT_KEYED
+        flags = iris_template.FLAG_COARSE_KEYED if keyed else 0
+        return iris_template.encode(words, nbits, algo, flags=flags, mask=mask, coarse=coarse)
+
+    @staticmethod
+    def load_template(stored, seed_token):
+        """
+        iris_template.load (binary or legacy JSON) with the mask section unsealed.
+        Raises ValueError on unknown algorithms.
+        """
+        template = iris_template.load(stored)
+        if template.algo not in iris_template.ALGO_NAMES:
+            raise ValueError(f"Unknown algo {template.algo}")
+        pads = transform_cache.section_pads(seed_token, template.nbits, template.algo)
+        if pads is not None and template.mask is not None:
+            template.mask = np.bitwise_xor(template.mask, pads[0])
+        return template
+
+    def vote(self, responses):
+        """
+        Per-bit majority vote over aligned Gabor responses, each normalized
+        (median 0, unit spread). Returns (code, summed response, votes).
+        """
+        normalized = []
+        for response in responses:
+            response = response - np.median(response)
+            normalized.append((response / (response.std() + 1e-6)).flatten())
+        normalized = np.stack(normalized)
+
+        votes = (normalized > 0).mean(axis=0)
+        fused = normalized.sum(axis=0)
+        code = np.where(votes == 0.5, fused > 0, votes > 0.5).astype(np.uint8)
+        return code, fused, votes
     
-    def cancelable_transform(self, iris_code, seed):
-        np.random.seed(seed)
-        n = len(iris_code)
-        perm = np.random.permutation(n)
-        scrambled = iris_code[perm]
-        mask = np.random.randint(0, 2, size=n, dtype=np.uint8)
+    def cancelable_transform(self, iris_code, seed, algo=iris_template.ALGO_BLOCKSCRAMBLE):
+        """
+        Permute + XOR mask. Accepts one code or a (shifts, n) batch of codes.
+        """
+        perm, mask = self.transform_tables(seed, iris_code.shape[-1], algo)
+        scrambled = iris_code[..., perm]
         secure_code = np.bitwise_xor(scrambled, mask)
         return secure_code
 
-    def verify(self, image_bytes, stored_template_json, seed_token):
+    def transform_tables(self, seed, n, algo=iris_template.ALGO_BLOCKSCRAMBLE):
+        # Cached per seed, built with a private RNG (thread-safe)
+        return transform_cache.get(seed, n, algo)
+
+    def verify(self, image_bytes, stored_template, seed_token, shift_mode="single_pass", cascade=True, history_key=None):
         """
-        Verify using Gabor with Image-Level Rotation Search.
+        Verify using Gabor with Rotation Search.
+        stored_template is a binary template (bytes) or a legacy JSON string.
+        Templates with a reliability mask are compared on their stable bits only.
+        BlockShift templates: the live code is extracted and transformed once,
+        then rolled block-wise against the stored code.
+        BlockScramble (legacy) templates: shift_mode="single_pass" filters the
+        strip once for all shifts, "per_shift" re-extracts every rolled strip.
+        cascade: templates with a coarse section are first scored on the 8x90
+        code; clear impostors stop there (and, with IRIS_COARSE_ACCEPT set,
+        clear genuine probes too).
+        history_key: e.g. (user_id, device_id). Shifts that matched for this key
+        are tried first and the search stops at the first accepted shift
+        (message "Matched (early exit)", score is that shift's score).
         """
         # 1. Preprocess IMAGE once
         img_norm = self.preprocess(image_bytes)
         if img_norm is None: return False, 0.0, "Preprocessing Failed"
         
-        # 2. Load Stored
+        # 2. Load Stored (zero-copy view of the packed words, mask unsealed)
         try:
-            data = json.loads(stored_template_json)
-            packed = np.frombuffer(base64.b64decode(data['b64']), dtype=np.uint8)
-            stored_secure_code = np.unpackbits(packed)
-            length = data['shape'][0]
-            stored_secure_code = stored_secure_code[:length]
+            template = self.load_template(stored_template, seed_token)
+            stored_words = template.words
+            length = template.nbits
+            tables = self.transform_tables(seed_token, length, template.algo)
         except Exception as e:
             return False, 0.0, f"Template Error: {e}"
 
-        best_score = 0.0
+        # 3. Coarse stage: rejects clear impostor probes cheaply
+        if cascade and template.coarse is not None:
+            coarse, coarse_shift = self.coarse_score(img_norm, template, seed_token)
+            if self.coarse_accept is not None and coarse >= self.coarse_accept:
+                if history_key is not None:
+                    shift_history.record(history_key, coarse_shift)
+                return True, coarse, "Matched (coarse)"
+            if coarse <= self.coarse_reject:
+                return False, coarse, "Rejected (coarse)"
+
+        best_score, best_shift, early_exit = 0.0, 0, False
         
-        # 3. Shift Search (Image Level)
+        # 4. Shift Search
         # Shift normalized image by +/- N pixels
-        shifts = range(-16, 17, 4) # +/- 16 pixels
+        shifts = self.shifts
+
+        # 4a. Remembered shifts first, stop at the first accepted one. BlockShift
+        #     shifts are a cheap roll each, so all of them go in order; legacy
+        #     shifts each cost a filter pass, so only remembered ones are tried
+        #     before the single-pass batch below.
+        searched = False
+        if history_key is not None and shift_mode == "single_pass":
+            if template.algo in iris_template.BLOCKSHIFT_ALGOS:
+                order = shift_history.ordered(history_key, shifts)
+            else:
+                order = shift_history.remembered(history_key)
+            best_score, best_shift, early_exit = self.ordered_search(img_norm, template, tables, order)
+            searched = early_exit or len(order) == len(shifts)
         
-        for s in shifts:
-            # Roll image
-            shifted_img = np.roll(img_norm, s, axis=1)
-            
-            # Extract Gabor Code
-            raw_code = self.extract_raw_code(shifted_img)
-            
-            # Transform
-            live_secure_code = self.cancelable_transform(raw_code, seed_token)
-            
-            # Match
-            dist = np.mean(live_secure_code != stored_secure_code)
-            score = (1.0 - dist) * 100
-            
-            if score > best_score:
-                best_score = score
+        if not searched:
+            if template.algo == iris_template.ALGO_BLOCKSCRAMBLE and shift_mode == "per_shift":
+                for s in shifts:
+                    # Roll image
+                    shifted_img = np.roll(img_norm, s, axis=1)
+                
+                    # Extract Gabor Code
+                    raw_code = self.extract_raw_code(shifted_img)
+                
+                    # Transform
+                    live_secure_code = self.cancelable_transform(raw_code, seed_token)
+                
+                    # Match
+                    dist = hamming.hamming_distance(hamming.pack_bits(live_secure_code), stored_words, length, template.mask)
+                    score = (1.0 - dist) * 100
+                
+                    if score > best_score:
+                        best_score, best_shift = score, s
+            else:
+                # Every shift scored in one batch (XOR + masked popcount)
+                probe = IrisProbe(self, img_norm)
+                dists = hamming.hamming_distance(probe.words(template.algo, tables), stored_words, length, template.mask)
+                best = int(np.argmin(dists))
+                best_score, best_shift = float((1.0 - dists[best]) * 100), shifts[best]
         
         # Threshold update: Gabor usually has 0.35-0.4 dist threshold.
         # Score > 60 is a reasonable starting point.
-        is_match = best_score > 60
+        is_match = best_score > self.early_accept
+
+        if is_match and history_key is not None:
+            shift_history.record(history_key, best_shift)
         
-        return is_match, best_score, "Matched"
+        return is_match, best_score, "Matched (early exit)" if early_exit else "Matched"
+
+    def ordered_search(self, img_norm, template, tables, order):
+        """
+        Score shifts one at a time in `order`, stopping at the first one above
+        early_accept. Returns (best score, its shift, early exit).
+        """
+        perm, mask = tables
+        if template.algo in iris_template.BLOCKSHIFT_ALGOS:
+            code = self.extract_circular_code(img_norm)
+
+        best_score, best_shift = 0.0, 0
+        for s in order:
+            if template.algo in iris_template.BLOCKSHIFT_ALGOS:
+                words = self.blockshift_words(code, tables, [s])[0]
+            else:
+                raw_code = self.extract_raw_code(np.roll(img_norm, s, axis=1))
+                words = hamming.pack_bits(np.bitwise_xor(raw_code[perm], mask))
+
+            score = float((1.0 - hamming.hamming_distance(words, template.words, template.nbits, template.mask)) * 100)
+            if score > best_score:
+                best_score, best_shift = score, s
+            if score > self.early_accept:
+                return score, s, True
+        return best_score, best_shift, False
+
+    def identify(self, image_bytes, gallery):
+        """
+        1:N: score the probe (all rotation shifts) against every user in an IrisGallery.
+        Returns (user_id or None, best score, is_match), is_match against the
+        gallery-size dependent 1:N threshold.
+        """
+        img_norm = self.preprocess(image_bytes)
+        if img_norm is None: return None, 0.0, False
+        
+        user_id, score, threshold = gallery.identify(IrisProbe(self, img_norm))
+        return user_id, score, user_id is not None and score > threshold
+
+    def adapt(self, image_bytes, stored_template, counters_blob, seed_token):
+        """
+        Online adaptation (opt-in): vote the aligned live code into the
+        template's per-bit counters. Everything stays in the cancelled domain.
+        Re-scores the capture and only adapts above template_adapter.min_score.
+        Returns (new template bytes, new counters bytes) or None.
+        """
+        img_norm = self.preprocess(image_bytes)
+        if img_norm is None: return None
+
+        try:
+            template = self.load_template(stored_template, seed_token)
+        except ValueError:
+            return None
+        tables = self.transform_tables(seed_token, template.nbits, template.algo)
+        pads = transform_cache.section_pads(seed_token, template.nbits, template.algo)
+
+        # Best-aligned live code (full search: the vote needs the true alignment)
+        live = IrisProbe(self, img_norm).words(template.algo, tables)
+        dists = hamming.hamming_distance(live, template.words, template.nbits, template.mask)
+        best = int(np.argmin(dists))
+        if (1.0 - dists[best]) * 100 < template_adapter.min_score:
+            return None
+
+        # Counters are sealed like the mask section
+        if pads is not None and counters_blob:
+            counters_blob = np.bitwise_xor(np.frombuffer(counters_blob, dtype=np.uint8), pads[1]).tobytes()
+        counters = template_adapter.load_counters(counters_blob, template)
+        bits, stable, counters = template_adapter.update(template, counters, live[best])
+
+        blob = self.encode_template(
+            bits, template.nbits, template.algo, seed_token,
+            mask=stable, coarse=template.coarse, coarse_algo=template.coarse_algo
+        )
+        counters = counters.view(np.uint8)
+        if pads is not None:
+            counters = np.bitwise_xor(counters, pads[1])
+        return blob, counters.tobytes()
+
+
+class IrisProbe:
+    """
+    One preprocessed live capture. Raw codes are extracted lazily, once per
+    template algorithm, and reused for every template it is scored against.
+    """
+    def __init__(self, service, img_norm):
+        self.service = service
+        self.img_norm = img_norm
+        self._shifted = None # ALGO_BLOCKSCRAMBLE: one code per shift
+        self._circular = None # BlockShift algos: one code, permuted once then rolled
+
+    def words(self, algo, tables):
+        """
+        Packed live codes for every rotation shift in the domain of `tables`: (shifts, n_words).
+        """
+        perm, mask = tables
+        return self.words_batch(algo, perm[None], hamming.pack_bits(mask)[None])[0]
+
+    def words_batch(self, algo, perms, mask_words):
+        """
+        words() for several transform domains at once (1:N over many seeds).
+        perms: (groups, nbits) gather indices, mask_words: (groups, n_words) packed pads.
+        Returns (groups, shifts, n_words).
+        """
+        if algo in iris_template.BLOCKSHIFT_ALGOS:
+            if self._circular is None:
+                self._circular = self.service.extract_circular_code(self.img_norm)
+            gathered = hamming.pack_bits(self._circular[perms])
+            rolled = self.service.roll_blocks(gathered, self.service.shifts)
+            return np.bitwise_xor(rolled, mask_words[:, None, :])
+
+        if self._shifted is None:
+            self._shifted = self.service.extract_shifted_codes(self.img_norm, self.service.shifts)
+        gathered = hamming.pack_bits(self._shifted[:, perms].transpose(1, 0, 2))
+        return np.bitwise_xor(gathered, mask_words[:, None, :])
@@ -0,0 +1,435 @@
+"""
+In-memory 1:N iris gallery.
+
+Every enrolled iris code lives in one contiguous (users x words) uint64 matrix.
+Transform tables are held once per distinct (seed, algo) group (users sharing
+a seed share them) as stacked uint16 gather indices and packed XOR pads. A
+probe is transformed once per group, in batches across groups, then scored
+against the matrix in vectorized chunks with XOR + popcount. Reliability
+masks sit in a parallel matrix (all ones for templates enrolled without one).
+
+The best user is compared with a threshold that tightens with the gallery
+size (threshold()), since the chance of some impostor scoring high grows with
+every enrolled user. The search stops early once a candidate clears the
+threshold of an `abort_factor` times larger gallery: any impostor reaches
+that score with only 1/abort_factor of the 1:N false match rate, so scanning
+the rest of the gallery would not change the answer.
+
+Scans run concurrently under a shared lock and read the matrices in place;
+add/remove/load wait for running scans to finish (and hold new ones back)
+before they touch rows or group tables.
+
+A group that reaches `index_min_size` users gets an LSH bit-sampling index
+(iris_index.py), bulk-built from its rows; identify() then only re-ranks the
+index candidates of that group. Indexes only pay off for large shared-seed
+groups: with one seed per user (after per-user re-keying) every group holds
+a single row, no index is built and every query is the batched linear scan.
+"""
+
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from scipy.special import ndtr, ndtri
+
+from .. import models
+from . import hamming
+from . import iris_template
+from .iris_index import IrisLSHIndex
+from .iris_cancelable_service import IrisCancelableService
+from .transform_cache import transform_cache
+
+
+class IrisGallery:
+    def __init__(self, chunk_size=1024, group_batch=128, verify_score=59.0, impostor_dof=500, index_min_size=20000, abort_factor=1e6):
+        self.chunk_size = chunk_size # Rows scored per vectorized step
+        self.group_batch = group_batch # Seed groups transformed per vectorized step
+        self.verify_score = verify_score # 1:1 acceptance threshold (score > verify_score)
+        self.impostor_dof = impostor_dof # Binomial degrees of freedom of impostor distances
+        self.index_min_size = index_min_size # Per group; below this an exact scan is affordable
+        self.abort_factor = abort_factor # Early abort at threshold(n * abort_factor), None: full scan
+
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock) # Signalled when scans/writers drain
+        self._scans = 0 # identify() calls reading the matrices
+        self._writers = 0 # add/remove/load waiting for the scans to drain
+        self.nbits = None
+        self.count = 0
+        self.words = None # (capacity, n_words) uint64
+        self.masks = None # (capacity, n_words) uint64, stable bits
+        self._full_mask = None
+        self._reset()
+
+    def __len__(self):
+        return self.count
+
+    # --- Maintenance ---
+
+    def load_from_db(self, db, batch_size=1000):
+        """
+        (Re)build the gallery from every BiometricTemplate holding an iris code.
+        """
+        Template = models.BiometricTemplate
+        with self._exclusive():
+            self._reset()
+
+        query = db.query(Template.user_id, Template.seed_token, Template.iris_template, Template.biohash_data)
+        for user_id, seed, blob, legacy in query.yield_per(batch_size):
+            stored = iris_template.pick_stored(blob, legacy)
+            if stored is None:
+                continue
+            try:
+                self.add(user_id, stored, seed)
+            except ValueError as e:
+                print(f"[IrisGallery] Skipping user {user_id}: {e}")
+
+        print(f"[IrisGallery] Loaded {self.count} iris templates.")
+        return self.count
+
+    def add(self, user_id, stored_template, seed):
+        """
+        Insert or replace one user's code (binary template or legacy JSON).
+        """
+        template = IrisCancelableService.load_template(stored_template, seed)
+        if template.nbits > 1 << 16:
+            raise ValueError(f"Code length {template.nbits} does not fit uint16 gather indices")
+        key = (seed, template.algo)
+
+        with self._lock:
+            known = key in self._group_of
+        if not known:
+            # Built outside the lock; the gallery keeps its own compact copy
+            perm, mask = transform_cache.build(seed, template.nbits, template.algo)
+
+        with self._exclusive():
+            if self.nbits is None:
+                self.nbits = template.nbits
+                self.words = np.empty((16, hamming.n_words(self.nbits)), dtype=np.uint64)
+                self.masks = np.empty_like(self.words)
+                self._full_mask = hamming.pack_bits(np.ones(self.nbits, dtype=np.uint8))
+                self.user_ids = np.empty(16, dtype=np.int64)
+                self.groups = np.empty(16, dtype=np.int32)
+                self.group_perms = np.empty((16, self.nbits), dtype=np.uint16)
+                self.group_pads = np.empty((16, self.words.shape[1]), dtype=np.uint64)
+                self.group_algos = np.zeros(16, dtype=np.int64)
+                self.group_rows = np.zeros(16, dtype=np.int64)
+            elif template.nbits != self.nbits:
+                raise ValueError(f"Code length {template.nbits} != gallery {self.nbits}")
+
+            group = self._group_of.get(key)
+            if group is None:
+                if known:
+                    # Dropped by a concurrent remove(): rebuild
+                    perm, mask = transform_cache.build(seed, template.nbits, template.algo)
+                group = self._new_group(key, perm, mask)
+
+            row = self._row_of_user.get(user_id)
+            old_group = None
+            if row is None:
+                row = self.count
+                self._grow(row + 1)
+                self.count += 1
+                self._row_of_user[user_id] = row
+            else:
+                old_group = int(self.groups[row])
+
+            self.words[row] = template.words
+            self.masks[row] = template.mask if template.mask is not None else self._full_mask
+            self.user_ids[row] = user_id
+            self.groups[row] = group
+            self.group_rows[group] += 1
+            if old_group is not None:
+                if old_group != group and old_group in self.indexes:
+                    self.indexes[old_group].remove(user_id)
+                self._release_group(old_group)
+
+            index = self.indexes.get(group)
+            if index is None:
+                if self.group_rows[group] >= self.index_min_size:
+                    self._build_index(group)
+                return
+
+        index.add(user_id, template.words, template.mask)
+
+    def remove(self, user_id):
+        with self._exclusive():
+            row = self._row_of_user.pop(user_id, None)
+            if row is None:
+                return False
+            group = int(self.groups[row])
+            if group in self.indexes:
+                self.indexes[group].remove(user_id)
+            self._release_group(group)
+
+            # Move the last row into the hole to keep the matrix contiguous
+            last = self.count - 1
+            if row != last:
+                self.words[row] = self.words[last]
+                self.masks[row] = self.masks[last]
+                self.user_ids[row] = self.user_ids[last]
+                self.groups[row] = self.groups[last]
+                self._row_of_user[int(self.user_ids[row])] = row
+            self.count -= 1
+            return True
+
+    @contextmanager
+    def _exclusive(self):
+        """
+        self._lock, once no identify() is reading the matrices. Waiting
+        writers hold new scans back, so they are not starved.
+        """
+        with self._lock:
+            self._writers += 1
+            try:
+                self._idle.wait_for(lambda: self._scans == 0)
+            finally:
+                self._writers -= 1
+                if self._writers == 0:
+                    self._idle.notify_all()
+            yield
+
+    def _reset(self):
+        self.nbits = None
+        self.count = 0
+        self.words = None
+        self.masks = None
+        self._full_mask = None
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.groups = np.empty(0, dtype=np.int32) # Row -> group slot
+        self._row_of_user = {}
+
+        # Seed groups, one slot each: (seed, algo) -> slot, freed slots are reused
+        self._group_of = {}
+        self.group_keys = []
+        self.group_algos = np.empty(0, dtype=np.int64)
+        self.group_rows = np.empty(0, dtype=np.int64) # Users per group
+        self.group_perms = None # (slots, nbits) uint16 gather indices
+        self.group_pads = None # (slots, n_words) uint64 packed XOR pads
+        self._free_groups = []
+        self.indexes = {} # Group slot -> IrisLSHIndex, for groups past index_min_size
+
+    def _new_group(self, key, perm, mask):
+        if self._free_groups:
+            group = self._free_groups.pop()
+        else:
+            group = len(self.group_keys)
+            self.group_keys.append(None)
+            self._grow_groups(group + 1)
+        self.group_keys[group] = key
+        self.group_algos[group] = key[1]
+        self.group_rows[group] = 0
+        self.group_perms[group] = perm
+        self.group_pads[group] = hamming.pack_bits(mask)
+        self._group_of[key] = group
+        return group
+
+    def _release_group(self, group):
+        self.group_rows[group] -= 1
+        if self.group_rows[group] == 0:
+            self.indexes.pop(group, None)
+            del self._group_of[self.group_keys[group]]
+            self.group_keys[group] = None
+            self._free_groups.append(group)
+
+    def _build_index(self, group):
+        rows = np.flatnonzero(self.groups[:self.count] == group)
+        index = IrisLSHIndex(self.nbits)
+        index.add_many(self.user_ids[rows], self.words[rows], self.masks[rows])
+        self.indexes[group] = index
+        print(f"[IrisGallery] Indexed group of {len(rows)} users.")
+
+    def _grow_groups(self, needed):
+        capacity = len(self.group_perms)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+
+        for name in ("group_perms", "group_pads", "group_algos", "group_rows"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _grow(self, needed):
+        capacity = len(self.words)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+
+        for name in ("words", "masks"):
+            old = getattr(self, name)
+            new = np.empty((capacity, old.shape[1]), dtype=np.uint64)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+        for name in ("user_ids", "groups"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    # --- Search ---
+
+    def threshold(self, n=None):
+        """
+        1:N acceptance score for a gallery of n users (default: current size).
+        Impostor distances are modelled as binomial with `impostor_dof` degrees
+        of freedom (normal approximation). The per-comparison false match rate
+        of the 1:1 threshold is split across the n users, so the chance that
+        any impostor is accepted stays at the 1:1 rate. n=1 gives verify_score.
+        """
+        n = max(self.count if n is None else n, 1)
+        spread = np.sqrt(0.25 / self.impostor_dof)
+        fmr = ndtr((0.5 - self.verify_score / 100) / spread)
+        return float(0.5 - spread * ndtri(fmr / n)) * 100
+
+    def identify(self, probe, use_index=True):
+        """
+        Score an IrisProbe (all rotation shifts) against every user.
+        Indexed groups only re-rank their LSH candidates (use_index=False
+        scans them too); every other group is scanned exhaustively.
+        Returns (user_id or None, best score 0-100, 1:N threshold); the best
+        user is a match only if its score is above the threshold. Stops at the
+        first candidate scoring at least threshold(n * abort_factor).
+        """
+        with self._lock:
+            self._idle.wait_for(lambda: self._writers == 0)
+            self._scans += 1
+        try:
+            return self._identify(probe, use_index)
+        finally:
+            with self._lock:
+                self._scans -= 1
+                if self._scans == 0:
+                    self._idle.notify_all()
+
+    def _identify(self, probe, use_index):
+        # Shared lock held: rows and group tables do not change underneath
+        count = self.count
+        threshold = self.threshold(count)
+        if count == 0:
+            return None, 0.0, threshold
+        groups = self.groups[:count]
+        tables = (self.group_perms, self.group_pads, self.group_algos)
+        indexes = self.indexes if use_index else {}
+        abort_dist = 1.0 - self.threshold(count * self.abort_factor) / 100 if self.abort_factor else -1.0
+
+        best_user, best_dist = None, 1.0
+
+        # 1. Indexed groups: exact scores for the candidates only
+        for group, index in indexes.items():
+            live = self._probe_words(probe, np.array([group]), tables, {})[0]
+            user, dist = self._rerank(live, index.candidates(live))
+            if dist < best_dist:
+                best_user, best_dist = user, dist
+            if best_dist <= abort_dist:
+                return best_user, (1.0 - best_dist) * 100, threshold
+
+        # 2. Every other group: linear scan
+        if indexes:
+            rows = np.flatnonzero(~np.isin(groups, list(indexes)))
+        else:
+            rows = np.arange(count)
+        if len(rows):
+            row, dist = self._scan(probe, rows, groups[rows], tables, abort_dist)
+            if dist < best_dist:
+                best_user, best_dist = int(self.user_ids[row]), dist
+
+        if best_user is None:
+            return None, 0.0, threshold
+        return best_user, (1.0 - best_dist) * 100, threshold
+
+    def _scan(self, probe, rows, row_groups, tables, abort_dist=-1.0):
+        """
+        Best (row, distance) among `rows`, in vectorized chunks; stops after
+        the chunk where a distance reaches abort_dist.
+        """
+        words, masks = self.words, self.masks
+        # Rows ordered by group, so each group's probe codes are built once
+        order = np.argsort(row_groups, kind="stable")
+        sorted_rows, sorted_groups = rows[order], row_groups[order]
+        contiguous = sorted_groups[0] == sorted_groups[-1] and len(rows) == rows[-1] + 1
+
+        best_row, best_dist = -1, 1.0
+        cache = {}
+
+        for start in range(0, len(rows), self.chunk_size):
+            stop = min(start + self.chunk_size, len(rows))
+            if contiguous:
+                chunk_rows = np.arange(start, stop)
+                chunk, chunk_masks = words[start:stop], masks[start:stop]
+            else:
+                chunk_rows = sorted_rows[start:stop]
+                chunk, chunk_masks = words[chunk_rows], masks[chunk_rows]
+
+            # 1. Transform + pack the probe for the chunk's groups (batched)
+            chunk_groups, inverse = np.unique(sorted_groups[start:stop], return_inverse=True)
+            live = self._probe_words(probe, chunk_groups, tables, cache)
+
+            # 2. Vectorized scores, best shift per row
+            if len(chunk_groups) == 1:
+                dists = hamming.hamming_cross(live[0], chunk, self.nbits, chunk_masks).min(axis=0)
+            else:
+                if len(chunk_groups) < len(chunk):
+                    live = live[inverse]
+                dists = hamming.hamming_distance(
+                    live, chunk[:, None, :], self.nbits, chunk_masks[:, None, :]
+                ).min(axis=1)
+            i = int(np.argmin(dists))
+            if dists[i] < best_dist:
+                best_row, best_dist = int(chunk_rows[i]), float(dists[i])
+
+            if best_dist <= abort_dist:
+                break
+
+            # Only the last group can continue into the next chunk
+            cache = {int(chunk_groups[-1]): live[-1]}
+
+        return best_row, best_dist
+
+    def _rerank(self, live, candidates):
+        """
+        Best (user_id, distance) among index candidates, (None, 1.0) if none.
+        """
+        # Index entries are added after the row (outside the lock): skip unknown users
+        rows = [self._row_of_user[u] for u in candidates.tolist() if u in self._row_of_user]
+        chunk, chunk_masks = self.words[rows], self.masks[rows]
+        chunk_users = self.user_ids[rows]
+        if not rows:
+            return None, 1.0
+
+        dists = hamming.hamming_cross(live, chunk, self.nbits, chunk_masks).min(axis=0)
+        i = int(np.argmin(dists))
+        return int(chunk_users[i]), float(dists[i])
+
+    def _probe_words(self, probe, groups, tables, cache):
+        """
+        Probe codes in the domain of each group: (len(groups), shifts, n_words).
+        Groups are transformed `group_batch` at a time, per algorithm; those
+        in `cache` (group -> codes) are reused.
+        """
+        perms, pads, algos = tables
+        out = None
+        for i, group in enumerate(groups.tolist()):
+            if group in cache:
+                out = self._place(out, len(groups), [i], cache[group][None])
+
+        todo = np.array([i for i, g in enumerate(groups.tolist()) if g not in cache], dtype=np.int64)
+        for algo in np.unique(algos[groups[todo]]).tolist():
+            same = todo[algos[groups[todo]] == algo]
+            for start in range(0, len(same), self.group_batch):
+                part = same[start:start + self.group_batch]
+                batch = groups[part]
+                out = self._place(out, len(groups), part, probe.words_batch(algo, perms[batch], pads[batch]))
+        return out
+
+    @staticmethod
+    def _place(out, n, where, live):
+        if out is None:
+            out = np.empty((n,) + live.shape[1:], dtype=np.uint64)
+        out[where] = live
+        return out
+
+
+# Shared gallery, built at startup (main.py) and updated on enrollment
+iris_gallery = IrisGallery()
@@ -0,0 +1,204 @@
+"""
+Sublinear candidate index for 1:N iris search (LSH by bit sampling).
+
+Each of `n_tables` hash tables samples `bits_per_key` fixed bit positions of
+the transformed code, and a template is filed under the key those bits form.
+A probe looks up the keys of every rotation shift; the union of the hit
+buckets is the candidate set IrisGallery re-ranks with the exact scorer.
+One index covers one (seed, algo) group: codes of different seeds live in
+different domains and are never comparable.
+
+Fragile bits (template reliability mask) among the sampled positions are
+filed under both values (up to `max_flips` per table), so an unstable bit
+does not cost a table.
+
+Buckets are flat arrays: every (table, key) pair is one integer, kept
+sorted next to the slot of the template it belongs to, and looked up with
+searchsorted. New entries go to a small pending buffer that is merged in
+once it grows; removed templates are tombstoned and compacted away later.
+"""
+
+import threading
+
+import numpy as np
+
+
+class IrisLSHIndex:
+    def __init__(self, nbits, n_tables=96, bits_per_key=16, max_flips=1, seed=0):
+        self.nbits = nbits
+        self.n_tables = n_tables
+        self.bits_per_key = bits_per_key
+        self.max_flips = max_flips
+
+        # Sampled positions, (tables, bits_per_key), fixed for the index lifetime
+        rng = np.random.RandomState(seed)
+        self.positions = np.stack([rng.choice(nbits, bits_per_key, replace=False) for _ in range(n_tables)])
+        flat = self.positions.reshape(-1)
+        self._byte = flat // 8
+        self._shift = (7 - flat % 8).astype(np.uint8) # np.packbits is MSB first
+        self._weights = 1 << np.arange(bits_per_key, dtype=np.int64)
+        # (table, key) -> table << bits_per_key | key
+        self._key_dtype = np.int32 if n_tables << bits_per_key <= 1 << 31 else np.int64
+        self._table_base = np.arange(n_tables, dtype=np.int64) << bits_per_key
+
+        self._lock = threading.Lock()
+        self._keys = np.empty(0, dtype=self._key_dtype) # Sorted bucket keys
+        self._slots = np.empty(0, dtype=np.int32) # Template slot of each key
+        self._pending_keys = []
+        self._pending_slots = []
+        self._pending_size = 0
+        self._slot_user = np.empty(0, dtype=np.int64)
+        self._alive = np.empty(0, dtype=bool)
+        self._n_slots = 0
+        self._slot_of = {} # user_id -> slot
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def sample(self, words):
+        """
+        (..., n_words) packed codes -> (..., tables, bits_per_key) sampled bits.
+        """
+        as_bytes = np.ascontiguousarray(words, dtype=np.uint64).view(np.uint8)
+        bits = (as_bytes[..., self._byte] >> self._shift) & 1
+        return bits.reshape(words.shape[:-1] + self.positions.shape)
+
+    def keys(self, words):
+        """
+        (..., n_words) packed codes -> (..., tables) int64 keys.
+        """
+        return self.sample(words).astype(np.int64) @ self._weights
+
+    def memory_bytes(self):
+        arrays = [self._keys, self._slots, self._slot_user, self._alive] + self._pending_keys + self._pending_slots
+        return sum(a.nbytes for a in arrays)
+
+    # --- Maintenance ---
+
+    def add(self, user_id, words, mask=None):
+        """
+        File one template (insert or replace) under its keys in every table.
+        """
+        self.add_many([user_id], np.asarray(words)[None], None if mask is None else np.asarray(mask)[None])
+
+    def add_many(self, user_ids, words, masks=None):
+        """
+        Bulk insert: (N, n_words) codes and optional (N, n_words) reliability masks.
+        """
+        user_ids = [int(u) for u in user_ids]
+        n = len(user_ids)
+        if n == 0:
+            return
+        bits = self.sample(words)
+        keys = bits.astype(np.int64) @ self._weights
+        if masks is not None:
+            fragile = self.sample(masks) == 0
+        else:
+            fragile = np.zeros_like(bits, dtype=bool)
+
+        # Key variants: every combination of the first `max_flips` fragile bits per table
+        first = np.argsort(~fragile, axis=2, kind="stable")[..., :self.max_flips]
+        flip = np.where(np.take_along_axis(fragile, first, axis=2), self._weights[first], 0)
+        combos = (np.arange(1 << first.shape[2])[:, None] >> np.arange(first.shape[2])) & 1
+        variants = keys[..., None] ^ np.bitwise_xor.reduce(combos * flip[..., None, :], axis=-1)
+        # (N, tables, variants); unflipped tables repeat the same key, keep it once
+        entries = (variants + self._table_base[:, None]).reshape(n, -1)
+        entries.sort(axis=1)
+        keep = np.ones(entries.shape, dtype=bool)
+        keep[:, 1:] = entries[:, 1:] != entries[:, :-1]
+
+        with self._lock:
+            for user_id in user_ids:
+                self._discard(user_id)
+            slots = np.arange(self._n_slots, self._n_slots + n, dtype=np.int32)
+            self._grow_slots(self._n_slots + n)
+            self._slot_user[slots] = user_ids
+            self._alive[slots] = True
+            self._n_slots += n
+            self._slot_of.update(zip(user_ids, slots.tolist()))
+
+            self._pending_keys.append(entries[keep].astype(self._key_dtype))
+            self._pending_slots.append(np.broadcast_to(slots[:, None], entries.shape)[keep])
+            self._pending_size += int(keep.sum())
+            if self._pending_size > max(1 << 16, len(self._keys) // 4):
+                self._merge()
+
+    def remove(self, user_id):
+        with self._lock:
+            return self._discard(user_id)
+
+    def _discard(self, user_id):
+        slot = self._slot_of.pop(user_id, None)
+        if slot is None:
+            return False
+        self._alive[slot] = False
+        if self._n_slots > 1024 and len(self._slot_of) < self._n_slots // 2:
+            self._compact()
+        return True
+
+    def _grow_slots(self, needed):
+        capacity = len(self._slot_user)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        for name in ("_slot_user", "_alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _merge(self):
+        """
+        Fold the pending buffer into the sorted arrays.
+        """
+        if not self._pending_size:
+            return
+        keys = np.concatenate([self._keys] + self._pending_keys)
+        slots = np.concatenate([self._slots] + self._pending_slots)
+        order = np.argsort(keys, kind="stable")
+        self._keys, self._slots = keys[order], slots[order]
+        self._pending_keys, self._pending_slots, self._pending_size = [], [], 0
+
+    def _compact(self):
+        """
+        Drop the entries of removed templates and renumber the live slots.
+        """
+        self._merge()
+        alive = self._alive[:self._n_slots]
+        live = alive[self._slots]
+        renumber = np.cumsum(alive, dtype=np.int32) - 1
+        self._keys = self._keys[live]
+        self._slots = renumber[self._slots[live]]
+
+        # New arrays: readers may hold the old ones (candidates() snapshot)
+        live_users = self._slot_user[:self._n_slots][alive]
+        self._n_slots = len(live_users)
+        self._slot_user = np.zeros(len(self._slot_user), dtype=np.int64)
+        self._slot_user[:self._n_slots] = live_users
+        self._alive = np.zeros(len(self._alive), dtype=bool)
+        self._alive[:self._n_slots] = True
+        self._slot_of = dict(zip(live_users.tolist(), range(self._n_slots)))
+
+    # --- Search ---
+
+    def candidates(self, probe_words):
+        """
+        User ids sharing at least one bucket with any probe shift, as an array.
+        probe_words: (shifts, n_words) packed codes in the index's domain.
+        """
+        query = np.unique(self.keys(np.atleast_2d(probe_words)) + self._table_base)
+        with self._lock:
+            keys, slots = self._keys, self._slots
+            pending = list(zip(self._pending_keys, self._pending_slots))
+            slot_user, alive = self._slot_user, self._alive
+
+        # Each query key hits one contiguous run of the sorted keys
+        lo = np.searchsorted(keys, query, side="left")
+        hi = np.searchsorted(keys, query, side="right")
+        lengths = hi - lo
+        starts = np.repeat(lo - np.cumsum(lengths) + lengths, lengths)
+        hits = [slots[starts + np.arange(lengths.sum())]]
+        hits += [pending_slots[np.isin(pending_keys, query)] for pending_keys, pending_slots in pending]
+
+        found = np.unique(np.concatenate(hits))
+        return slot_user[found[alive[found]]]
@@ -0,0 +1,183 @@
+"""
+Binary, versioned iris template format (BiometricTemplate.iris_template).
+
+Layout (little endian, 16-byte header so the bits start 8-byte aligned):
+  0   3s  magic     b"IRT"
+  3   B   version
+  4   B   algo id
+  5   B   flags     (optional sections present, see FLAG_*)
+  6   H   reserved
+  8   I   nbits
+  12  4x  padding
+  16  ..  packed bits (np.packbits order), zero padded to whole uint64 words
+
+Optional sections follow the code in flag order:
+  FLAG_MASK    n_words    reliability mask, 1 = stable bit (same permutation as the code;
+                          XOR sealed with a keyed pad for ALGO_BLOCKSHIFT_KEYED)
+  FLAG_COARSE  12 words   8x90 coarse code (COARSE_GRID) for the cascade in verify():
+                          ALGO_BLOCKSHIFT_KEYED transform with FLAG_COARSE_KEYED,
+                          ALGO_BLOCKSHIFT without (older templates)
+"""
+
+import json
+import base64
+import struct
+
+import numpy as np
+
+from . import hamming
+
+HEADER = struct.Struct("<3sBBBHI4x")
+MAGIC = b"IRT"
+VERSION = 1
+
+# Algorithm ids
+ALGO_BLOCKSCRAMBLE = 1 # Global permutation + XOR (rotation search re-extracts the live code)
+ALGO_BLOCKSHIFT = 2 # Block-structured permutation that commutes with circular column shifts
+                    # (one XOR row mask tiled over every block: linkable, kept for old templates)
+ALGO_BLOCKSHIFT_KEYED = 3 # Same permutation, a keyed pad over every bit (applied after the roll)
+
+ALGO_NAMES = {
+    ALGO_BLOCKSCRAMBLE: "BlockScramble_Gabor_ImgShift",
+    ALGO_BLOCKSHIFT: "BlockScramble_Gabor_BlockShift",
+    ALGO_BLOCKSHIFT_KEYED: "BlockScramble_Gabor_KeyedBlockShift",
+}
+
+# Rotation search rolls the transformed code (circular Gabor code)
+BLOCKSHIFT_ALGOS = (ALGO_BLOCKSHIFT, ALGO_BLOCKSHIFT_KEYED)
+
+# The mask section (and adaptation counters) are a function of the raw
+# code: under a block-structured permutation they are as linkable as an
+# unpadded code, so these algorithms store them sealed with a keyed pad
+# (TransformCache.section_pads).
+SEALED_ALGOS = (ALGO_BLOCKSHIFT_KEYED,)
+
+# ALGO_BLOCKSHIFT code geometry: (rows, columns, block width in columns).
+# A block holds rows * block = 128 bits = 2 uint64 words, so rotating the
+# strip by one block (4 px) rolls the stored code by exactly 2 words.
+BLOCKSHIFT_GRID = (32, 360, 4)
+
+# Coarse cascade code: the strip downsampled 4x. One block = one column =
+# 8 bits = 1 byte, and still covers 4 px of the full strip.
+COARSE_GRID = (8, 90, 1)
+COARSE_BITS = COARSE_GRID[0] * COARSE_GRID[1]
+ALGO_IDS = {name: algo for algo, name in ALGO_NAMES.items()}
+
+# Section flags
+FLAG_MASK = 0x01
+FLAG_COARSE = 0x02
+FLAG_COARSE_KEYED = 0x04 # Coarse code under ALGO_BLOCKSHIFT_KEYED tables
+
+
+def blockshift_grid(nbits):
+    """
+    BlockShift geometry of a code length (full or coarse code).
+    """
+    for grid in (BLOCKSHIFT_GRID, COARSE_GRID):
+        if grid[0] * grid[1] == nbits:
+            return grid
+    raise ValueError(f"No BlockShift grid for {nbits} bits")
+
+
+class IrisTemplate:
+    def __init__(self, algo, nbits, words, version=VERSION, flags=0, mask=None, coarse=None):
+        self.algo = algo
+        self.nbits = nbits
+        self.words = words # (n_words,) uint64, packed bits
+        self.version = version
+        self.flags = flags
+        self.mask = mask # (n_words,) uint64 or None (every bit compared)
+        self.coarse = coarse # (n_words(COARSE_BITS),) uint64 or None (no cascade)
+
+    @property
+    def algo_name(self):
+        return ALGO_NAMES.get(self.algo, f"unknown:{self.algo}")
+
+    @property
+    def coarse_algo(self):
+        return ALGO_BLOCKSHIFT_KEYED if self.flags & FLAG_COARSE_KEYED else ALGO_BLOCKSHIFT
+
+
+def encode(words, nbits, algo=ALGO_BLOCKSCRAMBLE, flags=0, mask=None, coarse=None):
+    """
+    Serialize packed uint64 words (and optional packed mask / coarse code)
+    to the binary template format.
+    """
+    sections = [(words, nbits)]
+    if mask is not None:
+        flags |= FLAG_MASK
+        sections.append((mask, nbits))
+    if coarse is not None:
+        flags |= FLAG_COARSE
+        sections.append((coarse, COARSE_BITS))
+
+    body = b""
+    for section, section_bits in sections:
+        section = np.ascontiguousarray(section, dtype=np.uint64)
+        if section.shape != (hamming.n_words(section_bits),):
+            raise ValueError(f"Expected {hamming.n_words(section_bits)} words for {section_bits} bits, got {section.shape}")
+        body += section.tobytes()
+
+    header = HEADER.pack(MAGIC, VERSION, algo, flags, 0, nbits)
+    return header + body
+
+
+def decode(blob):
+    """
+    Parse a binary template. The returned words are a zero-copy view of `blob`.
+    """
+    if len(blob) < HEADER.size:
+        raise ValueError("Template too short")
+    magic, version, algo, flags, _, nbits = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Not a binary iris template")
+    if version > VERSION:
+        raise ValueError(f"Unsupported template version {version}")
+
+    count = hamming.n_words(nbits)
+    coarse_count = hamming.n_words(COARSE_BITS)
+    size = HEADER.size + count * 8 * (1 + bool(flags & FLAG_MASK)) + coarse_count * 8 * bool(flags & FLAG_COARSE)
+    if len(blob) < size:
+        raise ValueError("Truncated template")
+    words = np.frombuffer(blob, dtype=np.uint64, count=count, offset=HEADER.size)
+    offset = HEADER.size + count * 8
+
+    mask = coarse = None
+    if flags & FLAG_MASK:
+        mask = np.frombuffer(blob, dtype=np.uint64, count=count, offset=offset)
+        offset += count * 8
+    if flags & FLAG_COARSE:
+        coarse = np.frombuffer(blob, dtype=np.uint64, count=coarse_count, offset=offset)
+    return IrisTemplate(algo, nbits, words, version=version, flags=flags, mask=mask, coarse=coarse)
+
+
+def from_legacy_json(template_json):
+    """
+    Convert a legacy biohash_data JSON template ({shape, b64, algo}) to binary.
+    """
+    data = json.loads(template_json)
+    packed = np.frombuffer(base64.b64decode(data['b64']), dtype=np.uint8)
+    nbits = data['shape'][0]
+    algo = ALGO_IDS.get(data.get('algo'), ALGO_BLOCKSCRAMBLE)
+    return encode(hamming.as_words(packed, nbits), nbits, algo)
+
+
+def pick_stored(blob, legacy_json):
+    """
+    The binary iris_template column, or the legacy JSON template still sitting
+    in biohash_data (rows not yet converted by backend/migrations.py).
+    """
+    if blob:
+        return blob
+    if legacy_json and legacy_json.startswith("{"):
+        return legacy_json
+    return None
+
+
+def load(stored):
+    """
+    Accept either a binary template (bytes) or a legacy JSON string.
+    """
+    if isinstance(stored, str):
+        stored = from_legacy_json(stored)
+    return decode(bytes(stored) if isinstance(stored, memoryview) else stored)
@@ -0,0 +1,120 @@
+"""
+Cheap presentation-attack pre-filter (printed / screen-replayed captures).
+
+Runs before any matching:
+  - moire (center crop of the capture at native or half resolution): a
+    screen or halftone print recaptured by a camera leaves sharp, isolated
+    peaks in the high-frequency band of the spectrum. Natural iris and palm
+    texture spreads that energy out. Stronger downscaling would low-pass
+    those patterns away.
+  - glare (quality gate thumbnail): glossy paper and screens reflect the
+    light source as one large saturated patch, much bigger than a corneal
+    highlight.
+Only obvious spoofs are rejected; this does not replace a real PAD model.
+Neither threshold has been measured on genuine captures yet, so by default
+the filter only logs what it would reject (PAD_ENFORCE=1 to reject).
+"""
+
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class PresentationAttackFilter:
+    def __init__(self, size=512, hf_radius=0.1, max_moire_peak=5.0, glare_level=250, max_glare=0.02, enforce=None):
+        self.size = size # Square FFT window (px)
+        self.hf_radius = hf_radius # High band starts at this fraction of Nyquist
+        self.max_moire_peak = max_moire_peak # High-band peak / its 7x7 neighborhood mean
+        self.glare_level = glare_level
+        self.max_glare = max_glare # Largest saturated blob, fraction of the frame
+        if enforce is None:
+            enforce = os.getenv("PAD_ENFORCE", "0") == "1"
+        self.enforce = enforce # False: flagged captures pass (log only)
+
+        # Hann window + high band mask, built once
+        window = np.hanning(size).astype(np.float32)
+        self._window = np.outer(window, window)
+        fy = np.fft.fftfreq(size)[:, None]
+        fx = np.fft.rfftfreq(size)[None, :]
+        self._high_band = np.hypot(fx, fy) > self.hf_radius * 0.5
+
+        # Metrics
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.rejects = {}
+        self.total_ms = 0.0
+
+    def measure(self, thumb, image=None):
+        """
+        Spoof metrics of a grayscale thumbnail and the capture it was made
+        from, decoded at most 2x reduced (default: the thumbnail itself).
+        """
+        # 1. Moire: center crop of the (near) native image, windowed real FFT
+        image = thumb if image is None else image
+        h, w = image.shape
+        s = min(self.size, h, w)
+        y0, x0 = (h - s) // 2, (w - s) // 2
+        crop = image[y0:y0 + s, x0:x0 + s].astype(np.float32)
+        if s != self.size:
+            crop = cv2.resize(crop, (self.size, self.size), interpolation=cv2.INTER_LINEAR)
+        crop -= crop.mean()
+        magnitude = np.abs(np.fft.rfft2(crop * self._window)).astype(np.float32)
+
+        # Isolated peaks only: a grating is a point in the spectrum, while
+        # edges and lines of real texture are streaks (high local average too)
+        local = cv2.blur(magnitude, (7, 7), borderType=cv2.BORDER_REFLECT)
+        moire_peak = float((magnitude / (local + 1e-6))[self._high_band].max())
+
+        # 2. Glare: largest saturated blob
+        h, w = thumb.shape
+        _, saturated = cv2.threshold(thumb, self.glare_level - 1, 255, cv2.THRESH_BINARY)
+        n, _, stats, _ = cv2.connectedComponentsWithStats(saturated, connectivity=8)
+        largest = stats[1:, cv2.CC_STAT_AREA].max() if n > 1 else 0
+        glare = float(largest / (h * w))
+
+        return {"moire_peak": moire_peak, "glare": glare}
+
+    def check(self, thumb, image=None):
+        """
+        Returns (ok, metrics, reason). When not enforcing, flagged captures
+        are logged and counted in stats() but pass.
+        """
+        start = time.perf_counter()
+        metrics = self.measure(thumb, image)
+
+        reason = None
+        if metrics["moire_peak"] > self.max_moire_peak:
+            reason = "Screen or print pattern detected"
+        elif metrics["glare"] > self.max_glare:
+            reason = "Reflective surface detected"
+
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.checks += 1
+            self.total_ms += elapsed
+            if reason:
+                self.rejects[reason] = self.rejects.get(reason, 0) + 1
+        if reason and not self.enforce:
+            print(f"[PAD] Would reject: {reason} (moire {metrics['moire_peak']:.2f}, "
+                  f"glare {metrics['glare']:.3f}; log only)")
+            reason = None
+        return reason is None, metrics, reason or "OK"
+
+    def stats(self):
+        with self._lock:
+            rejected = sum(self.rejects.values())
+            return {
+                "enforced": self.enforce, # False: "rejected" counts would-be rejects
+                "checks": self.checks,
+                "rejected": rejected,
+                "reject_rate": rejected / self.checks if self.checks else 0.0,
+                "avg_ms": self.total_ms / self.checks if self.checks else 0.0,
+                "by_reason": dict(self.rejects),
+            }
+
+
+# Shared; counters are process-wide
+pad_filter = PresentationAttackFilter()
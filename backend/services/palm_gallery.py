@@ -0,0 +1,229 @@
+"""
+In-memory 1:N palm gallery.
+
+Candidate search with a bag of visual words: every enrolled template is a
+TF-IDF vector over the words of a vocabulary tree (palm_vocabulary.py), kept
+as rows of a sparse matrix (an inverted file from words to users). A probe
+is scored against all rows with one sparse product, and only the `top_k`
+best users get full descriptor matching (PalmService.score).
+
+The vocabulary is trained from the enrolled templates once there are
+`min_vocabulary_templates` of them (below that, every user is re-ranked)
+and retrained when the gallery has grown by `retrain_growth`. New templates
+in between are appended to the index without retraining. Retraining after
+an enrollment runs on a background thread; the old vocabulary keeps serving
+(new templates included) until the new one is swapped in.
+"""
+
+import threading
+
+import numpy as np
+from scipy import sparse
+
+from .. import models
+from .palm_service import PalmService
+from .palm_vocabulary import PalmVocabularyTree
+
+
+class PalmGallery:
+    def __init__(self, top_k=10, min_vocabulary_templates=20, retrain_growth=2.0, merge_every=256):
+        self.top_k = top_k # Users re-ranked with full descriptor matching
+        self.min_vocabulary_templates = min_vocabulary_templates
+        self.retrain_growth = retrain_growth
+        self.merge_every = merge_every # Pending rows folded into the sparse matrix
+
+        self._lock = threading.Lock()
+        self._training = False # A background train() is running
+        self.templates = {} # user_id -> PalmTemplate
+        self._reset_index()
+
+    def __len__(self):
+        return len(self.templates)
+
+    def _reset_index(self, vocabulary=None):
+        self.vocabulary = vocabulary
+        self.trained_on = 0 # Gallery size at the last training
+        self._matrix = None # CSR (rows x words), merged rows
+        self._pending = [] # (word ids, weights) rows not merged yet
+        self._row_users = [] # Row -> user_id
+        self._active = [] # Row -> still the user's current template
+        self._row_of_user = {}
+
+    # --- Maintenance ---
+
+    def load_from_db(self, db, batch_size=1000):
+        """
+        (Re)build the gallery from every BiometricTemplate holding a palm template.
+        """
+        Template = models.BiometricTemplate
+        with self._lock:
+            self.templates = {}
+            self._reset_index()
+
+        query = db.query(Template.user_id, Template.palm_vault).filter(Template.palm_vault.isnot(None))
+        for user_id, palm_vault in query.yield_per(batch_size):
+            try:
+                template = PalmService.load_template(palm_vault)
+            except Exception as e:
+                template = None
+                print(f"[PalmGallery] Skipping user {user_id}: {e}")
+            if template is not None:
+                with self._lock:
+                    self.templates[user_id] = template
+
+        if len(self.templates) >= self.min_vocabulary_templates:
+            self.train()
+        print(f"[PalmGallery] Loaded {len(self.templates)} palm templates.")
+        return len(self.templates)
+
+    def add(self, user_id, palm_template_json):
+        """
+        Insert or replace one user's template (incremental: no retraining
+        unless the gallery outgrew its vocabulary, and then in the background).
+        """
+        template = PalmService.load_template(palm_template_json)
+        if template is None:
+            raise ValueError("Invalid palm template format")
+
+        with self._lock:
+            self.templates[user_id] = template
+            vocabulary = self.vocabulary
+            retrain = len(self.templates) >= max(self.min_vocabulary_templates, self.retrain_growth * self.trained_on)
+
+        if retrain:
+            self.train_async()
+        if vocabulary is not None:
+            row = vocabulary.bag(template.descriptors)
+            with self._lock:
+                if self.vocabulary is vocabulary:
+                    self._append(user_id, row)
+
+    def remove(self, user_id):
+        with self._lock:
+            if self.templates.pop(user_id, None) is None:
+                return False
+            row = self._row_of_user.pop(user_id, None)
+            if row is not None:
+                self._active[row] = False
+            return True
+
+    def train(self):
+        """
+        Fit a new vocabulary on the current templates and rebuild the index.
+        """
+        with self._lock:
+            snapshot = dict(self.templates)
+        if not snapshot:
+            return
+        vocabulary = PalmVocabularyTree().fit([t.descriptors for t in snapshot.values()])
+        rows = {user_id: vocabulary.bag(t.descriptors) for user_id, t in snapshot.items()}
+
+        with self._lock:
+            self._reset_index(vocabulary)
+            self.trained_on = len(snapshot)
+            for user_id, template in self.templates.items():
+                # Templates added or replaced while training
+                if snapshot.get(user_id) is not template:
+                    rows[user_id] = vocabulary.bag(template.descriptors)
+                self._append(user_id, rows[user_id])
+            self._merge()
+        print(f"[PalmGallery] Vocabulary trained on {len(snapshot)} templates ({vocabulary.n_words} words).")
+
+    def train_async(self):
+        """
+        train() on a daemon thread, at most one at a time (enrollment does
+        not wait for the fit). Returns False if one is already running.
+        """
+        with self._lock:
+            if self._training:
+                return False
+            self._training = True
+        threading.Thread(target=self._train_background, daemon=True).start()
+        return True
+
+    def _train_background(self):
+        try:
+            self.train()
+        except Exception as e:
+            print(f"[PalmGallery] Background training failed: {e}")
+        finally:
+            with self._lock:
+                self._training = False
+
+    def _append(self, user_id, row):
+        old = self._row_of_user.get(user_id)
+        if old is not None:
+            self._active[old] = False
+        self._row_of_user[user_id] = len(self._row_users)
+        self._row_users.append(user_id)
+        self._active.append(True)
+        self._pending.append(row)
+        if len(self._pending) >= self.merge_every:
+            self._merge()
+
+    def _merge(self):
+        if not self._pending:
+            return
+        indptr = np.concatenate([[0], np.cumsum([len(ids) for ids, _ in self._pending])])
+        block = sparse.csr_matrix(
+            (np.concatenate([w for _, w in self._pending]), np.concatenate([ids for ids, _ in self._pending]), indptr),
+            shape=(len(self._pending), self.vocabulary.n_words)
+        )
+        self._matrix = block if self._matrix is None else sparse.vstack([self._matrix, block], format="csr")
+        self._pending = []
+
+    # --- Search ---
+
+    def candidates(self, des_live):
+        """
+        Users ranked by TF-IDF similarity, best first (top_k of them).
+        Every user when there is no vocabulary yet.
+        """
+        with self._lock:
+            vocabulary = self.vocabulary
+            if vocabulary is None:
+                return list(self.templates)
+            matrix, pending = self._matrix, list(self._pending)
+            row_users, active = list(self._row_users), np.array(self._active, dtype=bool)
+
+        ids, weights = vocabulary.bag(des_live)
+        query = np.zeros(vocabulary.n_words, dtype=np.float32)
+        query[ids] = weights
+
+        scores = matrix @ query if matrix is not None else np.empty(0, dtype=np.float32)
+        scores = np.concatenate([scores, [float(w @ query[row_ids]) for row_ids, w in pending]])
+        scores[~active] = -np.inf
+
+        top = np.argsort(-scores)[:self.top_k]
+        return [row_users[i] for i in top if np.isfinite(scores[i])]
+
+    def identify(self, probe):
+        """
+        Full matching (PalmService.score) of the best TF-IDF candidates for a
+        PalmProbe. The shortlist uses the service's default budget; each
+        candidate is then scored with live features at its own template's
+        budget. Scores of templates with and without the geometric stage are
+        compared relative to their own thresholds.
+        Returns (user_id or None, its score, its threshold).
+        """
+        service = probe.service
+        des_live, _ = probe.features(service.budget)
+        if des_live is None:
+            return None, 0, 1
+
+        best_user, best_score, best_threshold = None, 0, 1
+        for user_id in self.candidates(des_live):
+            template = self.templates.get(user_id)
+            if template is None:
+                continue
+            des, pts = probe.features(template.budget)
+            if des is None or len(des) < 5:
+                continue
+            score, threshold = service.score(des, pts, template)
+            if score / threshold > best_score / best_threshold:
+                best_user, best_score, best_threshold = user_id, score, threshold
+        return best_user, best_score, best_threshold
+
+
+# Shared gallery, built at startup (main.py) and updated on enrollment
+palm_gallery = PalmGallery()
@@ -0,0 +1,117 @@
+"""
+Multi-probe LSH matcher for AKAZE binary descriptors (palm 1:1).
+
+Each of `n_tables` hash tables samples `bits_per_key` fixed bit positions of
+the 486-bit descriptor. Stored descriptors are bucketed by those keys (the
+keys are computed at enrollment and persisted in the palm template); a live
+descriptor probes its own bucket plus the buckets one flipped bit away
+(`n_flips` of them), in every table. Only the colliding pairs get an exact
+Hamming distance, and the two nearest candidates per live descriptor feed
+the usual ratio test.
+
+Far stored descriptors rarely collide, so the second neighbour found can be
+farther than the true one: callers pair the ratio test with an absolute
+distance cap (PalmService.lsh_max_distance).
+
+Everything is vectorized NumPy: no per-descriptor Python loop.
+"""
+
+import numpy as np
+
+from . import hamming
+
+DESCRIPTOR_BITS = 486 # AKAZE MLDB (61 bytes, last 2 bits unused)
+
+
+class PalmLSHIndex:
+    def __init__(self, n_tables=12, bits_per_key=16, n_flips=1, seed=0):
+        if bits_per_key > 16:
+            raise ValueError("bits_per_key must fit a uint16 key")
+        self.n_tables = n_tables
+        self.bits_per_key = bits_per_key
+        self.n_flips = n_flips # Multi-probe: single-bit flips probed per table
+        self.seed = seed
+
+        # Sampled positions, (tables, bits_per_key), fixed by the seed
+        rng = np.random.RandomState(seed)
+        self.positions = np.stack([rng.choice(DESCRIPTOR_BITS, bits_per_key, replace=False) for _ in range(n_tables)])
+        flat = self.positions.reshape(-1)
+        self._byte = flat // 8
+        self._shift = (7 - flat % 8).astype(np.uint8) # np.unpackbits order, MSB first
+        self._weights = (1 << np.arange(bits_per_key)).astype(np.uint16)
+
+        # Probe offsets: the key itself, then single-bit flips
+        self._probes = np.concatenate([[0], self._weights[:n_flips]]).astype(np.uint16)
+
+    def params(self):
+        return {"tables": self.n_tables, "bits": self.bits_per_key, "seed": self.seed}
+
+    def compatible(self, params):
+        return params == self.params()
+
+    def keys(self, des):
+        """
+        (n, 61) uint8 descriptors -> (n, tables) uint16 keys.
+        """
+        bits = (des[:, self._byte] >> self._shift) & 1
+        bits = bits.reshape(len(des), self.n_tables, self.bits_per_key)
+        return (bits.astype(np.uint16) * self._weights).sum(axis=2, dtype=np.uint16)
+
+    def candidate_pairs(self, live_keys, stored_keys):
+        """
+        (live index, stored index) pairs sharing a probed bucket in any table, unique.
+        """
+        n_stored = len(stored_keys)
+        pairs = []
+        for t in range(self.n_tables):
+            order = np.argsort(stored_keys[:, t], kind="stable")
+            table = stored_keys[order, t]
+
+            probes = live_keys[:, t, None] ^ self._probes # (live, probes)
+            lo = np.searchsorted(table, probes, side="left").ravel()
+            hi = np.searchsorted(table, probes, side="right").ravel()
+            counts = hi - lo
+            total = int(counts.sum())
+            if total == 0:
+                continue
+
+            # Expand every [lo, hi) bucket range without a Python loop
+            starts = np.repeat(lo, counts)
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            live = np.repeat(np.arange(len(live_keys)).repeat(len(self._probes)), counts)
+            pairs.append(live.astype(np.int64) * n_stored + order[starts + offsets])
+
+        if not pairs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        flat = np.unique(np.concatenate(pairs))
+        return flat // n_stored, flat % n_stored
+
+    def knn2(self, des_live, des_stored, stored_keys=None):
+        """
+        Approximate k=2 nearest stored descriptors of every live descriptor.
+        Returns (live idx, nearest idx, nearest dist, second dist) for every
+        live descriptor with a candidate. With a single candidate the second
+        distance is DESCRIPTOR_BITS + 1 (farther than any real neighbour).
+        """
+        if stored_keys is None:
+            stored_keys = self.keys(des_stored)
+        live_idx, stored_idx = self.candidate_pairs(self.keys(des_live), stored_keys)
+        if len(live_idx) == 0:
+            return live_idx, stored_idx, np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+        # Exact distances of the candidate pairs only (packed words, XOR + popcount)
+        live_words = hamming.as_words(des_live, DESCRIPTOR_BITS)
+        stored_words = hamming.as_words(des_stored, DESCRIPTOR_BITS)
+        dist = hamming.popcount(live_words[live_idx] ^ stored_words[stored_idx]).sum(axis=1, dtype=np.int32)
+
+        # Two smallest per live descriptor (pairs are grouped by live index)
+        order = np.lexsort((dist, live_idx))
+        live_idx, stored_idx, dist = live_idx[order], stored_idx[order], dist[order]
+        first = np.flatnonzero(np.r_[True, live_idx[1:] != live_idx[:-1]])
+        sizes = np.diff(np.r_[first, len(live_idx)])
+        second = np.where(sizes >= 2, dist[np.minimum(first + 1, len(dist) - 1)], DESCRIPTOR_BITS + 1)
+        return live_idx[first], stored_idx[first], dist[first], second
+
+
+# Shared hash family: persisted keys are only valid for these parameters
+palm_lsh = PalmLSHIndex()
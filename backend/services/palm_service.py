@@ -3,30 +3,96 @@ import cv2
 import numpy as np
 import json
 import base64
+import os
+
+from .palm_index import palm_lsh
+from . import image_io
+
+# Keypoint budget: the image is split into a grid and only the strongest
+# AKAZE responses of each cell are kept (bounded, evenly spread keypoints).
+# Recorded in the template; None = unbounded. New templates are unbounded
+# unless the geometric stage is on: 512 keypoints leave it enough inliers
+# (synthetic set), but the ratio test threshold is only measured unbounded.
+GEOMETRIC_BUDGET = {"grid": [8, 8], "per_cell": 8}
+
+# Match threshold (ratio test survivors), from the unbounded LUTBIO
+# benchmark: impostors <= 60 of ~2k live keypoints, genuine > 260. It is the
+# only measured point, so budgeted templates scored this way (no keypoint
+# coordinates) are held to it too: fewer keypoints only lower impostor
+# counts, at the cost of FRR. Re-enroll them for the geometric stage.
+RATIO_THRESHOLD = 100
+
+# Geometric verification: RANSAC inliers of a similarity transform (rotation,
+# uniform scale, translation) fitted on the best ratio test matches.
+# Chance matches rarely agree on one transform, so the inlier threshold
+# does not depend on the budget. Templates without keypoint coordinates
+# fall back to the ratio test count above.
+# Opt-in (PALM_GEOMETRIC=1): MIN_INLIERS has only been checked on synthetic
+# palms; run benchmark_palm_budget.py on LUTBIO (FAR/FRR at 15) first.
+MIN_INLIERS = 15
+
+
+def budget_size(budget):
+    rows, cols = budget["grid"]
+    return rows * cols * budget["per_cell"]
+
+
+class PalmTemplate:
+    """
+    Parsed palm template.
+    """
+    def __init__(self, descriptors, keys=None, budget=None, points=None):
+        self.descriptors = descriptors # (n, 61) uint8 AKAZE
+        self.keys = keys # (n, tables) uint16 LSH keys, None = recompute
+        self.budget = budget
+        self.points = points # (n, 2) float32 keypoint (x, y), None = no geometric stage
+
 
 class PalmService:
-    def __init__(self):
+    work_width = 800 # Preprocess caps captures at this width (AKAZE speed)
+
+    def __init__(self, matcher=None, budget="auto", geometric=None):
         # Switch to AKAZE for stability (Segmentation fault fix)
         self.detector = cv2.AKAZE_create() 
         # Matcher: Hamming distance works for AKAZE descriptors (binary)
         self.bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
+        # "bf": exhaustive knnMatch. "lsh": multi-probe LSH over the stored
+        # descriptors (palm_index.py), keys persisted in the template.
+        # Thresholds are calibrated on "bf"; LSH keeps ~87% of its good
+        # matches, so it is opt-in (PALM_MATCHER=lsh) until recalibrated.
+        self.matcher = matcher or os.getenv("PALM_MATCHER", "bf")
+        if self.matcher not in ("bf", "lsh"):
+            raise ValueError(f"Unknown palm matcher: {self.matcher}")
+        self.ratio = 0.75
+        self.lsh_max_distance = 80 # LSH can miss the true 2nd neighbour: also cap the 1st (bits of 486)
+        # Geometric stage (RANSAC inliers) for templates with keypoint
+        # coordinates; off: ratio test survivors vs RATIO_THRESHOLD
+        if geometric is None:
+            geometric = os.getenv("PALM_GEOMETRIC", "0") == "1"
+        self.geometric = geometric
+        # For new templates; verify uses the stored template's budget.
+        # "auto": GEOMETRIC_BUDGET with the geometric stage, unbounded without
+        if budget == "auto":
+            budget = GEOMETRIC_BUDGET if geometric else None
+        self.budget = budget
+        self.ransac_top = 200 # Best matches (by distance) given to RANSAC
+        self.ransac_reproj = 8.0 # Inlier distance (px, preprocessed image)
 
     def preprocess(self, image_bytes):
         """
-        Convert bytes to Grayscale and enhance contrast (CLAHE).
+        Convert bytes (or an already decoded grayscale image) to Grayscale
+        and enhance contrast (CLAHE).
         """
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is None:
+        # Grayscale decode (JPEGs at a reduced scale still >= 800 px wide)
+        gray = image_io.to_gray(image_bytes, self.work_width)
+        if gray is None:
             return None
         
         # Resize if too large (speed up AKAZE)
-        h, w = img.shape[:2]
-        if w > 800:
-            scale = 800 / w
-            img = cv2.resize(img, (int(w*scale), int(h*scale)))
-            
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape[:2]
+        if w > self.work_width:
+            scale = self.work_width / w
+            gray = cv2.resize(gray, (int(w*scale), int(h*scale)))
         
         # CLAHE (Contrast Limited Adaptive Histogram Equalization)
         # Enhances the palm lines significantly
@@ -35,6 +101,41 @@ class PalmService:
         
         return enhanced
 
+    def extract(self, img, budget=None, keypoints=None):
+        """
+        AKAZE keypoints + descriptors, limited to `budget` when given.
+        keypoints: detector output for `img`, when already at hand.
+        """
+        if budget is None:
+            return self.detector.detectAndCompute(img, None)
+        if keypoints is None:
+            keypoints = self.detector.detect(img, None)
+        # Describe only the kept keypoints
+        kp = self.select_keypoints(keypoints, img.shape, budget)
+        if not kp:
+            return kp, None
+        return self.detector.compute(img, kp)
+
+    def select_keypoints(self, keypoints, shape, budget):
+        """
+        Strongest `per_cell` keypoints (by detector response) in every grid cell.
+        """
+        if not keypoints:
+            return []
+        rows, cols = budget["grid"]
+        h, w = shape[:2]
+        pts = np.array([k.pt for k in keypoints], dtype=np.float32)
+        response = np.array([k.response for k in keypoints], dtype=np.float32)
+        cell = (np.minimum((pts[:, 1] * rows / h).astype(int), rows - 1) * cols
+                + np.minimum((pts[:, 0] * cols / w).astype(int), cols - 1))
+
+        # Rank inside each cell, strongest first
+        order = np.lexsort((-response, cell))
+        cell = cell[order]
+        start = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+        rank = np.arange(len(cell)) - np.repeat(start, np.diff(np.r_[start, len(cell)]))
+        return [keypoints[i] for i in order[rank < budget["per_cell"]]]
+
     def create_template(self, image_bytes):
         """
         Extract descriptors and serialize to JSON compatible format.
@@ -47,8 +148,8 @@ class PalmService:
             
         # print(f"[PalmService] Detecting Features (Shape: {img.shape})...")
         try:
-            # Detect and Compute
-            kp, des = self.detector.detectAndCompute(img, None)
+            # Detect and Compute (within the keypoint budget)
+            kp, des = self.extract(img, self.budget)
             # print(f"[PalmService] Found {len(kp)} keypoints.")
         except Exception as e:
             print(f"[PalmService] Feature Detector Error: {e}")
@@ -61,28 +162,130 @@ class PalmService:
         # Convert descriptors (numpy uint8) to Base64 string for storage
         des_b64 = base64.b64encode(des.tobytes()).decode('utf-8')
         
+        # Keypoint coordinates for the geometric stage (int16 px: images are <= 800 wide)
+        points = np.round([k.pt for k in kp]).astype(np.int16)
+        
+        # LSH bucket keys of every descriptor (uint16 per table), so the
+        # "lsh" matcher does not re-hash the stored set on each verify
+        keys = palm_lsh.keys(des)
+        
         data = {
             "shape": des.shape,
             "dtype": str(des.dtype),
-            "b64": des_b64
+            "b64": des_b64,
+            "lsh": dict(palm_lsh.params(), b64=base64.b64encode(keys.tobytes()).decode('utf-8')),
+            "budget": self.budget,
+            "kp": base64.b64encode(points.tobytes()).decode('utf-8')
         }
         return json.dumps(data)
 
+    @staticmethod
+    def load_template(stored_template_json):
+        """
+        Parse a stored template into a PalmTemplate, or None for an unknown
+        (legacy) format.
+        Keys are dropped when missing (older templates) or hashed with other
+        parameters; the LSH matcher then recomputes them.
+        """
+        data = json.loads(stored_template_json)
+        # Support legacy format check (if user had old implementation)
+        if "b64" not in data:
+            return None
+
+        dtype = np.dtype(data['dtype']) if 'dtype' in data else np.uint8
+        des_stored = np.frombuffer(base64.b64decode(data['b64']), dtype=dtype)
+        des_stored = des_stored.reshape(data['shape'])
+
+        keys = None
+        lsh = data.get("lsh")
+        if lsh and palm_lsh.compatible({k: v for k, v in lsh.items() if k != "b64"}):
+            keys = np.frombuffer(base64.b64decode(lsh["b64"]), dtype=np.uint16)
+            keys = keys.reshape(len(des_stored), palm_lsh.n_tables)
+
+        points = None
+        if "kp" in data:
+            points = np.frombuffer(base64.b64decode(data["kp"]), dtype=np.int16)
+            points = points.reshape(len(des_stored), 2).astype(np.float32)
+        return PalmTemplate(des_stored, keys, data.get("budget"), points)
+
+    def good_matches(self, des_live, des_stored, stored_keys=None):
+        """
+        Matches passing Lowe's ratio test: (live idx, stored idx, distance) arrays.
+        """
+        if self.matcher == "lsh":
+            live_idx, stored_idx, d1, d2 = palm_lsh.knn2(des_live, des_stored, stored_keys)
+            good = (d1 < self.ratio * d2) & (d1 <= self.lsh_max_distance)
+            return live_idx[good], stored_idx[good], d1[good]
+
+        # knnMatch with k=2 for Ratio Test
+        matches = self.bf.knnMatch(des_live, des_stored, k=2)
+        
+        good_matches = []
+        for m, n in matches:
+            # Lowe's Ratio Test
+            # If the closest match is significantly closer than the second closest, it's a "Good" match.
+            # 0.75 is standard. Stricter = 0.7
+            if m.distance < self.ratio * n.distance:
+                good_matches.append((m.queryIdx, m.trainIdx, m.distance))
+        good = np.array(good_matches, dtype=np.float32).reshape(-1, 3)
+        return good[:, 0].astype(np.int64), good[:, 1].astype(np.int64), good[:, 2]
+
+    def match(self, des_live, des_stored, stored_keys=None):
+        """
+        Number of live descriptors passing Lowe's ratio test against the stored set.
+        """
+        return len(self.good_matches(des_live, des_stored, stored_keys)[0])
+
+    def geometric_score(self, pts_live, pts_stored, distances):
+        """
+        RANSAC inliers of a similarity transform over the best matches.
+        pts_live / pts_stored: (n, 2) coordinates of matched keypoint pairs.
+        """
+        if len(distances) < 3:
+            return 0
+        best = np.argsort(distances, kind="stable")[:self.ransac_top]
+        _, inliers = cv2.estimateAffinePartial2D(
+            pts_live[best], pts_stored[best], method=cv2.RANSAC, ransacReprojThreshold=self.ransac_reproj
+        )
+        return int(inliers.sum()) if inliers is not None else 0
+
+    def score(self, des_live, pts_live, stored):
+        """
+        Score of a live capture against a PalmTemplate: RANSAC inliers when
+        the geometric stage is on and the template has keypoint coordinates,
+        ratio test survivors otherwise.
+        Returns (score, threshold).
+        """
+        live_idx, stored_idx, distances = self.good_matches(des_live, stored.descriptors, stored.keys)
+        if not self.geometric or stored.points is None:
+            return len(live_idx), RATIO_THRESHOLD
+        score = self.geometric_score(pts_live[live_idx], stored.points[stored_idx], distances)
+        return score, MIN_INLIERS
+
+    def identify(self, image_bytes, gallery):
+        """
+        1:N: TF-IDF shortlist from a PalmGallery, then full matching.
+        Returns (user_id or None, best score, is_match).
+        """
+        img = self.preprocess(image_bytes)
+        if img is None:
+            return None, 0, False
+        probe = PalmProbe(self, img)
+        des_live, _ = probe.features(self.budget)
+        if des_live is None or len(des_live) < 5:
+            return None, 0, False
+        user_id, score, threshold = gallery.identify(probe)
+        return user_id, score, user_id is not None and score >= threshold
+
     def verify(self, image_bytes, stored_template_json):
         """
         Match live image against stored template using Ratio Test.
         """
         # 1. Parse Stored Template
         try:
-            data = json.loads(stored_template_json)
-            # Support legacy format check (if user had old implementation)
-            if "b64" not in data: 
+            stored = self.load_template(stored_template_json)
+            if stored is None:
                 return False, 0.0, "Invalid Template Format"
-                
-            dtype = np.dtype(data['dtype']) if 'dtype' in data else np.uint8
-            
-            des_stored = np.frombuffer(base64.b64decode(data['b64']), dtype=dtype)
-            des_stored = des_stored.reshape(data['shape'])
         except Exception as e:
             print(f"[PalmService] Template Error: {e}")
             return False, 0.0, "Template Error"
@@ -92,35 +295,53 @@ class PalmService:
         if img is None:
             return False, 0.0, "Image Error"
             
-        kp_live, des_live = self.detector.detectAndCompute(img, None)
+        # Same budget as the stored side, so scores fit its threshold
+        kp_live, des_live = self.extract(img, stored.budget)
         
         if des_live is None or len(des_live) < 5:
             return False, 0.0, "No Features Found"
             
-        # 3. Match
-        # knnMatch with k=2 for Ratio Test
-        matches = self.bf.knnMatch(des_live, des_stored, k=2)
-        
-        good_matches = []
-        for m, n in matches:
-            # Lowe's Ratio Test
-            # If the closest match is significantly closer than the second closest, it's a "Good" match.
-            # 0.75 is standard. Stricter = 0.7
-            if m.distance < 0.75 * n.distance:
-                good_matches.append(m)
-                
-        # 4. Scoring
+        # 3. Match + Scoring (RANSAC inliers, or ratio test survivors for
+        #    templates without keypoint coordinates)
         # How many good matches defined "Identity"?
         # For Palm, usually 20-50 matches is strong evidence.
-        score = len(good_matches)
+        pts_live = np.array([k.pt for k in kp_live], dtype=np.float32)
+        score, threshold = self.score(des_live, pts_live, stored)
         
-        # Threshold:
+        # Threshold (ratio test count):
         # < 10: Noise
         # 10-20: Weak Match
         # > 25: Strong Match
         # BENCHMARK UPDATE: Imposters get up to 60. Genuines get > 260.
-        # Safe Threshold: 100
-        is_match = score >= 100
+        # Safe Threshold: 100 (RATIO_THRESHOLD)
+        is_match = score >= threshold
         
         return is_match, score, "Matched"
 
+
+class PalmProbe:
+    """
+    One preprocessed live capture. Keypoints are detected once; descriptors
+    are computed lazily per keypoint budget and reused for every template of
+    that budget (each template is scored at its own budget, as in verify).
+    """
+    def __init__(self, service, img):
+        self.service = service
+        self.img = img
+        self._keypoints = None
+        self._features = {} # budget key -> (descriptors, points)
+
+    def features(self, budget):
+        """
+        (descriptors, (n, 2) float32 points) at `budget`; descriptors None if no keypoints.
+        """
+        key = None if budget is None else (tuple(budget["grid"]), budget["per_cell"])
+        if key not in self._features:
+            if budget is None:
+                kp, des = self.service.extract(self.img)
+            else:
+                if self._keypoints is None:
+                    self._keypoints = self.service.detector.detect(self.img, None)
+                kp, des = self.service.extract(self.img, budget, self._keypoints)
+            self._features[key] = (des, np.array([k.pt for k in kp], dtype=np.float32))
+        return self._features[key]
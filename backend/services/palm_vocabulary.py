@@ -0,0 +1,113 @@
+"""
+Vocabulary tree over AKAZE binary descriptors (palm 1:N).
+
+Hierarchical k-majority clustering (k-means for binary descriptors: the
+center of a cluster is the per-bit majority of its members, distances are
+Hamming). `branching` children per node, `depth` levels: a descriptor is
+quantized to one of branching ** depth visual words by descending the tree,
+comparing it with `branching` centers per level only.
+
+IDF weights are computed from the descriptor sets the tree is trained on.
+"""
+
+import numpy as np
+
+from . import hamming
+from .palm_index import DESCRIPTOR_BITS
+
+
+class PalmVocabularyTree:
+    def __init__(self, branching=8, depth=4, iterations=5, max_train_descriptors=100000, seed=0):
+        self.branching = branching
+        self.depth = depth
+        self.iterations = iterations # k-majority refinement steps per node
+        self.max_train_descriptors = max_train_descriptors # Random sample above this
+        self.seed = seed
+
+        self.centers = None # Per level: (branching ** (level + 1), n_words) uint64
+        self.idf = None # (n_words,) float32
+
+    @property
+    def n_words(self):
+        return self.branching ** self.depth
+
+    def _distances(self, words, centers):
+        """
+        (n, W) x (k, W) packed descriptors -> (n, k) Hamming distances.
+        """
+        return hamming.popcount(words[:, None, :] ^ centers[None, :, :]).sum(axis=2, dtype=np.int32)
+
+    def _kmajority(self, words, rng):
+        """
+        `branching` centers for one node's descriptors.
+        """
+        k = self.branching
+        n = len(words)
+        if n <= k:
+            # Too few to split: every descriptor is its own center (repeated to fill)
+            return words[np.arange(k) % n] if n else np.zeros((k, words.shape[1]), dtype=np.uint64)
+
+        centers = words[rng.choice(n, k, replace=False)]
+        bits = hamming.unpack_words(words, DESCRIPTOR_BITS).astype(np.float32)
+        for _ in range(self.iterations):
+            labels = np.argmin(self._distances(words, centers), axis=1)
+            # Majority vote per bit (empty clusters keep their center)
+            onehot = (labels[None, :] == np.arange(k)[:, None]).astype(np.float32)
+            counts = onehot.sum(axis=1)
+            ones = onehot @ bits
+            filled = counts > 0
+            centers[filled] = hamming.pack_bits(2 * ones[filled] > counts[filled, None])
+        return centers
+
+    def fit(self, descriptor_sets):
+        """
+        Train on a list of (n_i, 61) uint8 descriptor arrays (one per template).
+        """
+        rng = np.random.RandomState(self.seed)
+        words = hamming.as_words(np.concatenate(descriptor_sets), DESCRIPTOR_BITS)
+        if len(words) > self.max_train_descriptors:
+            words = words[rng.choice(len(words), self.max_train_descriptors, replace=False)]
+
+        # Level by level: split every node of the previous level
+        self.centers = []
+        node = np.zeros(len(words), dtype=np.int64)
+        for level in range(self.depth):
+            centers = np.empty((self.branching ** (level + 1), words.shape[1]), dtype=np.uint64)
+            order = np.argsort(node, kind="stable")
+            bounds = np.searchsorted(node[order], np.arange(self.branching ** level + 1))
+            for parent in range(self.branching ** level):
+                members = order[bounds[parent]:bounds[parent + 1]]
+                centers[parent * self.branching:(parent + 1) * self.branching] = self._kmajority(words[members], rng)
+            self.centers.append(centers)
+            node = self._descend(words, node, level)
+
+        # IDF over the training templates
+        df = np.zeros(self.n_words, dtype=np.int64)
+        for des in descriptor_sets:
+            df[np.unique(self.quantize(des))] += 1
+        self.idf = np.log((len(descriptor_sets) + 1) / (df + 1)).astype(np.float32)
+        return self
+
+    def _descend(self, words, node, level):
+        children = node[:, None] * self.branching + np.arange(self.branching)
+        dists = hamming.popcount(words[:, None, :] ^ self.centers[level][children]).sum(axis=2, dtype=np.int32)
+        return children[np.arange(len(words)), np.argmin(dists, axis=1)]
+
+    def quantize(self, descriptors):
+        """
+        (n, 61) uint8 descriptors -> (n,) visual word ids.
+        """
+        words = hamming.as_words(descriptors, DESCRIPTOR_BITS)
+        node = np.zeros(len(words), dtype=np.int64)
+        for level in range(self.depth):
+            node = self._descend(words, node, level)
+        return node
+
+    def bag(self, descriptors):
+        """
+        L2-normalized TF-IDF vector as (word ids, weights).
+        """
+        ids, counts = np.unique(self.quantize(descriptors), return_counts=True)
+        weights = counts.astype(np.float32) / counts.sum() * self.idf[ids]
+        norm = np.linalg.norm(weights)
+        return ids, weights / norm if norm > 0 else weights
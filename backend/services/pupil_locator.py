@@ -0,0 +1,114 @@
+"""
+Coarse-to-fine pupil localization.
+
+1. Coarse: pick the dark threshold of the full-resolution median-9 image (the
+   old contour loop's image, so the threshold is stable between captures)
+   without running the median, then score every dark blob of a pyrDown level
+   at once from cv2.connectedComponentsWithStats (no per-contour Python loop).
+2. Refine: re-segment only a small window around the winning blob at full
+   resolution and fit the enclosing circle there.
+
+Cost is bounded by the (fixed) pyramid size plus one small window.
+"""
+
+import cv2
+import numpy as np
+
+
+class PupilLocator:
+    def __init__(self, dark_fraction=0.05, max_threshold=60, levels=1, median_size=9):
+        self.dark_fraction = dark_fraction # Pupil ~ darkest 5% of pixels
+        self.max_threshold = max_threshold
+        self.levels = levels # pyrDown steps for the coarse search
+        self.median_size = median_size # Smoothing the threshold is defined on
+
+    def dark_threshold(self, gray):
+        """
+        First gray level whose cumulative histogram exceeds dark_fraction of the pixels.
+        """
+        hist = np.bincount(gray.ravel(), minlength=256)
+        cdf = np.cumsum(hist)
+        threshold_val = int(np.searchsorted(cdf, gray.size * self.dark_fraction, side="right"))
+        return min(threshold_val, self.max_threshold)
+
+    def smoothed_threshold(self, img):
+        """
+        dark_threshold(cv2.medianBlur(img, median_size)) without the median.
+
+        A pixel's median is <= t iff more than half of its window is <= t, so
+        the smoothed histogram at t is one box sum of (img <= t); the first
+        level over dark_fraction is found by bisection over 0..max_threshold.
+        """
+        k = self.median_size
+        majority = k * k // 2 + 1
+        target = img.size * self.dark_fraction
+        lo, hi = 0, self.max_threshold
+        while lo < hi:
+            t = (lo + hi) // 2
+            votes = cv2.boxFilter((img <= t).view(np.uint8), -1, (k, k), normalize=False, borderType=cv2.BORDER_REPLICATE)
+            if np.count_nonzero(votes >= majority) > target:
+                hi = t
+            else:
+                lo = t + 1
+        return lo
+
+    def locate(self, img):
+        """
+        Returns the pupil circle (x, y, radius) in `img` coordinates.
+        """
+        h, w = img.shape
+        fallback = (w // 2, h // 2, w // 6)
+
+        # --- 1. Coarse search on the pyramid level ---
+        coarse = img
+        for _ in range(self.levels):
+            coarse = cv2.pyrDown(coarse)
+        factor = w / coarse.shape[1]
+
+        blurred = cv2.medianBlur(coarse, 5)
+        threshold_val = self.smoothed_threshold(img)
+        _, thresh = cv2.threshold(blurred, threshold_val, 255, cv2.THRESH_BINARY_INV)
+
+        n, _, stats, centroids = cv2.connectedComponentsWithStats(thresh, connectivity=8)
+        if n <= 1:
+            return fallback
+        stats, centroids = stats[1:], centroids[1:] # Drop background
+
+        area = stats[:, cv2.CC_STAT_AREA].astype(np.float64)
+        bw = stats[:, cv2.CC_STAT_WIDTH].astype(np.float64)
+        bh = stats[:, cv2.CC_STAT_HEIGHT].astype(np.float64)
+
+        # Same size window as the full-res contour filter (50 px .. 15% of image)
+        total = coarse.shape[0] * coarse.shape[1]
+        valid = (area >= 50 / factor ** 2) & (area <= total * 0.15)
+        if not valid.any():
+            return fallback
+
+        # Circularity proxy: disk fill ratio of the bounding box * aspect ratio
+        diameter = np.maximum(bw, bh)
+        circularity = (area / (np.pi * (diameter / 2) ** 2)) * (np.minimum(bw, bh) / diameter)
+
+        center = np.array([coarse.shape[1] / 2, coarse.shape[0] / 2])
+        dist_from_center = np.linalg.norm(centroids - center, axis=1)
+        score = np.where(valid, circularity * (1 - dist_from_center / coarse.shape[1]) * 2, -np.inf)
+        best = int(np.argmax(score))
+
+        # --- 2. Refine in a window around the winner at full resolution ---
+        x0, y0 = stats[best, cv2.CC_STAT_LEFT], stats[best, cv2.CC_STAT_TOP]
+        margin = max(bw[best], bh[best]) * 0.5 + 2
+        left = int(max((x0 - margin) * factor, 0))
+        top = int(max((y0 - margin) * factor, 0))
+        right = int(min((x0 + bw[best] + margin) * factor, w))
+        bottom = int(min((y0 + bh[best] + margin) * factor, h))
+
+        window = cv2.medianBlur(np.ascontiguousarray(img[top:bottom, left:right]), 9)
+        _, window_thresh = cv2.threshold(window, threshold_val, 255, cv2.THRESH_BINARY_INV)
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(window_thresh, connectivity=8)
+        if n <= 1:
+            cx, cy = centroids[best] * factor
+            return int(cx), int(cy), int(diameter[best] * factor / 2)
+
+        largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        points = cv2.findNonZero((labels == largest).astype(np.uint8))
+        (x, y), radius = cv2.minEnclosingCircle(points)
+        return int(x + left), int(y + top), int(radius)
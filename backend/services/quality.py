@@ -0,0 +1,155 @@
+"""
+Early-reject capture quality gate.
+
+Runs on a ~200 px grayscale thumbnail before any feature extraction, so a
+blurry, dark or off-center capture costs a couple of milliseconds instead of
+a full preprocess + Gabor / AKAZE pass. Thresholds are per modality.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+from .pupil_locator import PupilLocator
+from . import image_io
+
+
+class CaptureQualityGate:
+    def __init__(self, thumb_width=200,
+                 min_focus=20.0, min_brightness=40.0, max_brightness=215.0, max_clipped=0.25,
+                 min_pupil_area=0.002, max_pupil_area=0.15, max_pupil_offset=0.35,
+                 min_palm_area=0.15, max_palm_area=0.95, max_palm_offset=0.35, enforce_palm_area=None):
+        self.thumb_width = thumb_width
+
+        # Focus: Laplacian variance on the thumbnail (sharp eyes/palms >> 100)
+        self.min_focus = min_focus
+
+        # Exposure: mean gray level and fraction of clipped pixels
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped = max_clipped
+
+        # Iris: dark pupil blob, as a fraction of the frame, near the center
+        self.min_pupil_area = min_pupil_area
+        self.max_pupil_area = max_pupil_area
+        self.max_pupil_offset = max_pupil_offset
+
+        # Palm: Otsu foreground, as a fraction of the frame, near the center.
+        # The area band was never measured on genuine captures: out-of-band
+        # captures are only logged unless QUALITY_ENFORCE_PALM_AREA=1.
+        self.min_palm_area = min_palm_area
+        self.max_palm_area = max_palm_area
+        self.max_palm_offset = max_palm_offset
+        if enforce_palm_area is None:
+            enforce_palm_area = os.getenv("QUALITY_ENFORCE_PALM_AREA", "0") == "1"
+        self.enforce_palm_area = enforce_palm_area
+
+        self.pupil_locator = PupilLocator()
+
+    def thumbnail(self, image_bytes):
+        img = image_io.decode_gray(image_bytes, self.thumb_width)
+        if img is None:
+            return None
+        return self.downscale(img)
+
+    def downscale(self, img):
+        """
+        Thumbnail of an already decoded grayscale image.
+        """
+        h, w = img.shape
+        if w > self.thumb_width:
+            img = cv2.resize(img, (self.thumb_width, max(int(h * self.thumb_width / w), 1)), interpolation=cv2.INTER_AREA)
+        return img
+
+    def _as_thumbnail(self, image_or_thumb):
+        if isinstance(image_or_thumb, (bytes, bytearray, memoryview)):
+            return self.thumbnail(image_or_thumb)
+        return image_or_thumb
+
+    def _common(self, thumb):
+        """
+        Focus + exposure. Returns (metrics, reason or None).
+        """
+        metrics = {
+            "focus": float(cv2.Laplacian(thumb, cv2.CV_64F).var()),
+            "brightness": float(thumb.mean()),
+            "clipped": float(np.mean((thumb < 10) | (thumb > 245))),
+        }
+        # Exposure first: a dark frame also reads as out of focus
+        if metrics["brightness"] < self.min_brightness:
+            return metrics, "Image too dark"
+        if metrics["brightness"] > self.max_brightness:
+            return metrics, "Image overexposed"
+        if metrics["clipped"] > self.max_clipped:
+            return metrics, "Too many clipped pixels"
+        if metrics["focus"] < self.min_focus:
+            return metrics, "Image out of focus"
+        return metrics, None
+
+    def assess_iris(self, image_or_thumb):
+        """
+        Accepts either bytes or an already decoded thumbnail.
+        Returns (ok, metrics, reason).
+        """
+        thumb = self._as_thumbnail(image_or_thumb)
+        if thumb is None:
+            return False, {}, "Image Error"
+        metrics, reason = self._common(thumb)
+
+        # Pupil presence: dark blob below the histogram threshold
+        h, w = thumb.shape
+        blurred = cv2.medianBlur(thumb, 5)
+        threshold_val = self.pupil_locator.dark_threshold(blurred)
+        _, dark = cv2.threshold(blurred, threshold_val, 255, cv2.THRESH_BINARY_INV)
+        n, _, stats, centroids = cv2.connectedComponentsWithStats(dark, connectivity=8)
+        if n > 1:
+            largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+            cx, cy = centroids[largest]
+            metrics["pupil_area"] = float(stats[largest, cv2.CC_STAT_AREA] / (h * w))
+            metrics["pupil_offset"] = float(np.hypot(cx / w - 0.5, cy / h - 0.5))
+        else:
+            metrics["pupil_area"] = 0.0
+            metrics["pupil_offset"] = 1.0
+
+        if reason is None:
+            if not (self.min_pupil_area <= metrics["pupil_area"] <= self.max_pupil_area):
+                reason = "Pupil not found"
+            elif metrics["pupil_offset"] > self.max_pupil_offset:
+                reason = "Eye not centered"
+        return reason is None, metrics, reason or "OK"
+
+    def assess_palm(self, image_or_thumb):
+        """
+        Accepts either bytes or an already decoded thumbnail.
+        Returns (ok, metrics, reason).
+        """
+        thumb = self._as_thumbnail(image_or_thumb)
+        if thumb is None:
+            return False, {}, "Image Error"
+        metrics, reason = self._common(thumb)
+
+        # Palm presence: Otsu foreground (hand vs background)
+        h, w = thumb.shape
+        _, fg = cv2.threshold(cv2.GaussianBlur(thumb, (5, 5), 0), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        ys, xs = np.nonzero(fg)
+        metrics["palm_area"] = float(len(xs) / (h * w))
+        if len(xs):
+            metrics["palm_offset"] = float(np.hypot(xs.mean() / w - 0.5, ys.mean() / h - 0.5))
+        else:
+            metrics["palm_offset"] = 1.0
+
+        if reason is None:
+            if not (self.min_palm_area <= metrics["palm_area"] <= self.max_palm_area):
+                if self.enforce_palm_area:
+                    reason = "Palm not found"
+                else:
+                    print(f"[Quality] Palm area {metrics['palm_area']:.3f} outside "
+                          f"{self.min_palm_area}-{self.max_palm_area} (log only, not rejected)")
+            if reason is None and metrics["palm_offset"] > self.max_palm_offset:
+                reason = "Palm not centered"
+        return reason is None, metrics, reason or "OK"
+
+
+# Shared, stateless
+quality_gate = CaptureQualityGate()
@@ -0,0 +1,55 @@
+import threading
+from collections import Counter, OrderedDict, deque
+
+
+class ShiftHistory:
+    """
+    Recently matching rotation shifts per (template, device) key, LRU bounded.
+
+    Returning users on a fixed kiosk present the eye at nearly the same
+    angle, so the shift that matched last time is the best first guess.
+    """
+    def __init__(self, maxsize=10000, depth=8):
+        self.maxsize = maxsize
+        self.depth = depth # Matches remembered per key
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remembered(self, key):
+        """
+        Shifts that matched for `key`, most frequent (then most recent) first.
+        """
+        with self._lock:
+            recent = self._recent.get(key)
+            if recent is None:
+                return []
+            self._recent.move_to_end(key)
+            recent = list(recent)
+        counts = Counter(recent)
+        last_seen = {s: i for i, s in enumerate(recent)}
+        return sorted(counts, key=lambda s: (-counts[s], -last_seen[s]))
+
+    def ordered(self, key, shifts):
+        """
+        Every shift: remembered ones first, then the rest center-out.
+        """
+        first = self.remembered(key)
+        return first + sorted((s for s in shifts if s not in first), key=abs)
+
+    def record(self, key, shift):
+        with self._lock:
+            recent = self._recent.get(key)
+            if recent is None:
+                recent = self._recent[key] = deque(maxlen=self.depth)
+            recent.append(shift)
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.maxsize:
+                self._recent.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+
+
+# Shared by every IrisCancelableService instance (routes build one per request)
+shift_history = ShiftHistory()
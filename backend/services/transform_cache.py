@@ -0,0 +1,165 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import event
+
+from .. import models
+from . import hamming
+from . import iris_template
+
+
+class TransformCache:
+    """
+    Bounded LRU cache of cancelable transform tables (permutation, XOR mask) per seed.
+
+    Tables are built with a private RandomState instead of np.random.seed(),
+    so verification never touches global NumPy state and is safe across threads.
+    Every algorithm is expressed as a flat (gather index, XOR mask) pair.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, seed, n, algo=iris_template.ALGO_BLOCKSCRAMBLE):
+        key = (int(seed), int(n), int(algo))
+        with self._lock:
+            tables = self._tables.get(key)
+            if tables is not None:
+                self._tables.move_to_end(key)
+                self.hits += 1
+                return tables
+            self.misses += 1
+
+        # Build outside the lock (permutation of n elements is the slow part)
+        tables = self.build(*key)
+
+        with self._lock:
+            self._tables[key] = tables
+            self._tables.move_to_end(key)
+            while len(self._tables) > self.maxsize:
+                self._tables.popitem(last=False)
+                self.evictions += 1
+        return tables
+
+    @classmethod
+    def build(cls, seed, n, algo=iris_template.ALGO_BLOCKSCRAMBLE):
+        """
+        Uncached tables (bulk jobs touching many one-off seeds, e.g. re-keying).
+        """
+        if algo == iris_template.ALGO_BLOCKSHIFT:
+            return cls._build_blockshift(seed, n, iris_template.blockshift_grid(n))
+        if algo == iris_template.ALGO_BLOCKSHIFT_KEYED:
+            return cls._build_blockshift(seed, n, iris_template.blockshift_grid(n), keyed=True)
+        return cls._build(seed, n)
+
+    @staticmethod
+    def _build(seed, n):
+        # RandomState(seed) replays the exact stream of np.random.seed(seed),
+        # so stored templates stay byte-compatible.
+        rng = np.random.RandomState(seed)
+        perm = rng.permutation(n)
+        mask = rng.randint(0, 2, size=n, dtype=np.uint8)
+
+        # Shared between threads: make them read-only
+        perm.setflags(write=False)
+        mask.setflags(write=False)
+        return perm, mask
+
+    @staticmethod
+    def _build_blockshift(seed, n, grid, keyed=False):
+        """
+        Rotation-compatible tables. Output bit (q, r, j) of block q takes
+            input bit (row_perm[r], block * ((q + offsets[r, j]) % Q) + col_perm[r, j])
+        Rolling the input by k blocks of columns rolls the gathered code by
+        k blocks, so rotation search can roll the live code before the XOR.
+        (Key space is smaller than the global permutation: per-row choices only.)
+
+        ALGO_BLOCKSHIFT XORs row_mask[r, j], the same in every block: each
+        (r, j) slot across the blocks is then a shifted (maybe inverted) row
+        of the raw code, the same for every seed. ALGO_BLOCKSHIFT_KEYED XORs
+        an independent keyed bit everywhere instead, from a stream of its own
+        per (seed, n) (full and coarse codes never share pad bits).
+        """
+        rows, cols, block = grid
+        if rows * cols != n or cols % block:
+            raise ValueError(f"Code of {n} bits does not fit grid {grid}")
+        q = cols // block
+
+        if keyed:
+            rng = np.random.RandomState([seed, n, iris_template.ALGO_BLOCKSHIFT_KEYED])
+        else:
+            rng = np.random.RandomState(seed)
+        row_perm = rng.permutation(rows)
+        col_perm = np.argsort(rng.rand(rows, block), axis=1)
+        offsets = rng.randint(0, q, size=(rows, block))
+
+        blocks = np.arange(q)[:, None, None]
+        src_cols = block * ((blocks + offsets[None]) % q) + col_perm[None]
+        perm = (row_perm[None, :, None] * cols + src_cols).reshape(-1)
+        if keyed:
+            mask = rng.randint(0, 2, size=n, dtype=np.uint8)
+        else:
+            row_mask = rng.randint(0, 2, size=(rows, block), dtype=np.uint8)
+            mask = np.tile(row_mask.reshape(-1), q)
+
+        perm.setflags(write=False)
+        mask.setflags(write=False)
+        return perm, mask
+
+    @staticmethod
+    def section_pads(seed, n, algo):
+        """
+        Keyed pads for the sections stored next to the code of an
+        iris_template.SEALED_ALGOS template: (mask pad, packed (n_words,)
+        uint64; counters pad, (n,) uint8). None for other algorithms.
+        """
+        if algo not in iris_template.SEALED_ALGOS:
+            return None
+        rng = np.random.RandomState([seed, n, algo, 1])
+        mask_pad = hamming.pack_bits(rng.randint(0, 2, size=n, dtype=np.uint8))
+        counters_pad = rng.randint(0, 256, size=n, dtype=np.uint8)
+        return mask_pad, counters_pad
+
+    def invalidate(self, seed):
+        """
+        Drop every table built from `seed` (e.g. after the token is revoked).
+        """
+        with self._lock:
+            stale = [key for key in self._tables if key[0] == seed]
+            for key in stale:
+                del self._tables[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._tables),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared by every IrisCancelableService instance (routes build one per request)
+transform_cache = TransformCache()
+
+
+@event.listens_for(models.BiometricTemplate.seed_token, "set")
+def _invalidate_on_seed_change(target, value, oldvalue, initiator):
+    # oldvalue is a sentinel (not an int) when the row is new or not loaded
+    if isinstance(oldvalue, int) and oldvalue != value:
+        transform_cache.invalidate(oldvalue)